@@ -1,7 +1,7 @@
 import torch
 import copy
 
-torch.cuda.set_device(0)
+
 class GANFactory:
     factories = {}
 
@@ -60,7 +60,6 @@ class NoGAN(GANTrainer):
 class SingleGAN(GANTrainer):
     def __init__(self, net_d, criterion):
         GANTrainer.__init__(self, net_d, criterion)
-        self.net_d = self.net_d.cuda(0)
 
     def loss_d(self, pred, gt):
         return self.criterion(self.net_d, pred, gt)
@@ -76,21 +75,65 @@ class SingleGAN(GANTrainer):
         def create(net_d, criterion): return SingleGAN(net_d, criterion)
 
 
+class _SharedForward:
+    """Runs a fused (patch, full) discriminator once per input and hands the outputs to the two
+    criteria, which each see a discriminator of their own through `branch`."""
+    def __init__(self, net_d):
+        self.net_d = net_d
+        self.outputs = {}
+
+    def __call__(self, x, index):
+        # the criteria detach fakes separately, so the view of the storage identifies the input; the
+        # entry keeps x alive, no later tensor can reuse its memory, and an in-place change of the
+        # values bumps the version counter that detached views share
+        key = (x.data_ptr(), x.shape, x.stride(), x.dtype, x.device, x._version, x.requires_grad)
+        if key not in self.outputs:
+            self.outputs[key] = (x, self.net_d(x))
+        return self.outputs[key][1][index]
+
+    def branch(self, index):
+        return _Branch(self, index)
+
+
+class _Branch:
+    def __init__(self, shared, index):
+        self.shared = shared
+        self.index = index
+
+    def forward(self, x):
+        return self.shared(x, self.index)
+
+    __call__ = forward
+
+
 class DoubleGAN(GANTrainer):
     def __init__(self, net_d, criterion):
         GANTrainer.__init__(self, net_d, criterion)
-        self.patch_d = net_d['patch'].cuda(0)
-        self.full_d = net_d['full'].cuda(0)
+        # a dict of two discriminators, or one DoubleDiscriminator with a shared trunk
+        self.fused = not isinstance(net_d, dict)
+        if not self.fused:
+            self.patch_d = net_d['patch']
+            self.full_d = net_d['full']
         self.full_criterion = copy.deepcopy(criterion)
 
+    def _nets(self):
+        if not self.fused:
+            return self.patch_d, self.full_d
+        shared = _SharedForward(self.net_d)
+        return shared.branch(0), shared.branch(1)
+
     def loss_d(self, pred, gt):
-        return (self.criterion(self.patch_d, pred, gt) + self.full_criterion(self.full_d, pred, gt)) / 2
+        patch_d, full_d = self._nets()
+        return (self.criterion(patch_d, pred, gt) + self.full_criterion(full_d, pred, gt)) / 2
 
     def loss_g(self, pred, gt):
-        return (self.criterion.get_g_loss(self.patch_d, pred, gt) + self.full_criterion.get_g_loss(self.full_d, pred,
-                                                                                                  gt)) / 2
+        patch_d, full_d = self._nets()
+        return (self.criterion.get_g_loss(patch_d, pred, gt) + self.full_criterion.get_g_loss(full_d, pred,
+                                                                                             gt)) / 2
 
     def get_params(self):
+        if self.fused:
+            return list(self.net_d.parameters())
         return list(self.patch_d.parameters()) + list(self.full_d.parameters())
 
     class Factory:
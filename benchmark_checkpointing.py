@@ -0,0 +1,99 @@
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import time
+from itertools import product
+
+import numpy as np
+import torch
+
+from models.networks import get_generator
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Memory and throughput of generator training steps with and without checkpointing')
+    parser.add_argument('--crops', type=int, nargs='+', default=[256, 384, 512], help='Square crop sizes')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=('cpu', 'cuda'))
+    parser.add_argument('--frozen', action='store_true', help='Keep the backbone frozen, as in the warmup epochs')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed steps before measuring')
+    parser.add_argument('--iters', type=int, default=10, help='Timed steps')
+    parser.add_argument('--output', default='benchmark_checkpointing.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(setting):
+    """Measures forward and backward of the generator for one setting, in a fresh process."""
+    device = torch.device(setting['device'])
+    model = get_generator({'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin',
+                           'checkpointing': setting['checkpointing'],
+                           'fast_warmup': setting.get('fast_warmup', False)}, cuda=False, pretrained=False).to(device)
+    # trained in the mode it is built in, like Trainer does
+    if not setting['frozen']:
+        model.unfreeze()
+    optimizer = torch.optim.Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=1e-4)
+    x = torch.rand(setting['batch_size'], 3, setting['crop'], setting['crop'], device=device) * 2 - 1
+    target = torch.rand_like(x) * 2 - 1
+
+    def step():
+        optimizer.zero_grad()
+        loss = (model(x) - target).abs().mean()
+        loss.backward()
+        optimizer.step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    for _ in range(setting['warmup']):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    times = []
+    for _ in range(setting['iters']):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+
+    times = np.array(times) * 1000
+    result = dict(setting,
+                  step_ms=float(times.mean()),
+                  samples_per_sec=float(setting['batch_size'] * 1000 / times.mean()),
+                  peak_rss_mb=max_rss_mb())
+    if device.type == 'cuda':
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    return result
+
+
+def main():
+    args = get_args()
+    settings = [{'crop': crop, 'batch_size': batch_size, 'checkpointing': checkpointing, 'frozen': args.frozen,
+                 'device': args.device, 'warmup': args.warmup, 'iters': args.iters}
+                for crop, batch_size, checkpointing in product(args.crops, args.batch_sizes, (False, True))]
+
+    results = []
+    ctx = mp.get_context('spawn')
+    for setting in settings:
+        try:
+            with ctx.Pool(1) as pool:
+                r = pool.apply(run, (setting,))
+        except RuntimeError as e:
+            # out of memory, which is what checkpointing is for
+            r = dict(setting, error=str(e).splitlines()[0])
+            print('crop={crop} batch={batch_size} checkpointing={checkpointing}: {error}'.format(**r))
+            results.append(r)
+            continue
+        memory = r['peak_cuda_mb'] if 'peak_cuda_mb' in r else r['peak_rss_mb']
+        print('crop={crop} batch={batch_size} checkpointing={checkpointing}: {step_ms:.1f}ms/step, '
+              '{samples_per_sec:.2f} samples/sec, '.format(**r) + f'peak memory {memory:.0f}MB')
+        results.append(r)
+
+    with open(args.output, 'w') as f:
+        json.dump({'torch': torch.__version__, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import time
+from copy import deepcopy
+
+import cv2
+import yaml
+
+from dataset import PairedDataset, get_dataloader
+
+cv2.setNumThreads(0)
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Benchmark the training input pipeline without a model')
+    parser.add_argument('--config', default='config/config.yaml', help='Training config')
+    parser.add_argument('--split', default='train', choices=('train', 'val'), help='Dataset split to load')
+    parser.add_argument('--num_workers', type=int, nargs='*',
+                        help='Worker counts to sweep, defaults to the dataloader block of the config')
+    parser.add_argument('--batches', type=int, default=200, help='Batches measured per epoch')
+    parser.add_argument('--epochs', type=int, default=2,
+                        help='Epochs per setting, later epochs show the effect of persistent workers')
+    parser.add_argument('--output', help='Optional json file for the results')
+    return parser.parse_args()
+
+
+def benchmark(loader, batches, epochs):
+    """Iterates `loader` like the training loop does and returns samples/sec for every epoch."""
+    results = []
+    for epoch in range(epochs):
+        samples = 0
+        start = time.perf_counter()
+        for i, data in enumerate(loader):
+            if i == batches:
+                break
+            samples += len(data['a'])
+        elapsed = time.perf_counter() - start
+        results.append({'epoch': epoch, 'samples': samples, 'seconds': elapsed,
+                        'samples_per_sec': samples / elapsed})
+    return results
+
+
+if __name__ == '__main__':
+    args = get_args()
+    with open(args.config) as cfg:
+        config = yaml.safe_load(cfg)
+    dataset = PairedDataset.from_config(config[args.split])
+    loader_config = config.get('dataloader', {})
+
+    report = []
+    for num_workers in args.num_workers or [loader_config.get('num_workers')]:
+        settings = deepcopy(loader_config)
+        settings['num_workers'] = num_workers
+        loader = get_dataloader(dataset, batch_size=config['batch_size'], **settings)
+        epochs = benchmark(loader, args.batches, args.epochs)
+        for r in epochs:
+            print('num_workers={}, epoch {}: {:.1f} samples/sec'.format(loader.num_workers, r['epoch'],
+                                                                        r['samples_per_sec']))
+        report.append({'num_workers': loader.num_workers, 'settings': settings, 'epochs': epochs})
+        del loader
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
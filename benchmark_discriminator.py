@@ -0,0 +1,79 @@
+import argparse
+import json
+import time
+from copy import deepcopy
+
+import numpy as np
+import torch
+from thop import profile
+
+from models.networks import get_discriminator
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Discriminator cost of double_gan with separate and shared-trunk discriminators')
+    parser.add_argument('--crops', type=int, nargs='+', default=[256, 512], help='Square crop sizes')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--d_layers', type=int, default=3)
+    parser.add_argument('--norm_layer', default='instance')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=('cpu', 'cuda'))
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--output', default='benchmark_discriminator.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def as_list(net_d):
+    return list(net_d.values()) if isinstance(net_d, dict) else [net_d]
+
+
+def measure(net_d, x, iters, device):
+    nets = as_list(net_d)
+    macs = sum(profile(deepcopy(net), inputs=(x[:1],), verbose=False)[0] for net in nets)
+
+    def step():
+        # a D step sees a fake and a real batch, the G step one more forward of each
+        loss = 0
+        for net in nets:
+            for outputs in (net(x), net(x.flip(0))):
+                for output in outputs if isinstance(outputs, tuple) else (outputs,):
+                    loss = loss + output.mean()
+        loss.backward()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    step()
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - start)
+    return {'gmacs_per_image': macs / 1e9, 'step_ms': float(np.mean(times) * 1000),
+            'params_m': sum(p.numel() for net in nets for p in net.parameters()) / 1e6}
+
+
+def main():
+    args = get_args()
+    device = torch.device(args.device)
+    results = []
+    for crop in args.crops:
+        x = torch.rand(args.batch_size, 3, crop, crop, device=device) * 2 - 1
+        row = {'crop': crop, 'batch_size': args.batch_size}
+        for shared in (False, True):
+            torch.manual_seed(0)
+            net_d = get_discriminator({'d_name': 'double_gan', 'd_layers': args.d_layers,
+                                       'norm_layer': args.norm_layer, 'shared_d_trunk': shared}, cuda=False)
+            for net in as_list(net_d):
+                net.to(device)
+            row['shared' if shared else 'separate'] = measure(net_d, x, args.iters, device)
+        separate, shared = row['separate'], row['shared']
+        print(f'crop={crop}: {separate["gmacs_per_image"]:.2f} -> {shared["gmacs_per_image"]:.2f} GMACs per image '
+              f'and forward, D step {separate["step_ms"]:.1f} -> {shared["step_ms"]:.1f}ms, '
+              f'{separate["params_m"]:.2f}M -> {shared["params_m"]:.2f}M parameters')
+        results.append(row)
+
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
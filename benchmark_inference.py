@@ -0,0 +1,114 @@
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import time
+from copy import deepcopy
+from itertools import product
+
+import numpy as np
+import torch
+from thop import profile
+
+from models.networks import get_generator, set_inference_mode
+
+NORM_LAYERS = {'fpn_ghostnet_gm_hin': 'hin',
+               'fpn_mobilenet': 'instance'}
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Benchmark generator inference')
+    parser.add_argument('--models', nargs='+', default=list(NORM_LAYERS), choices=list(NORM_LAYERS))
+    parser.add_argument('--resolutions', nargs='+', default=['256', '736x1280', '1088x1920'],
+                        help='Input sizes as HxW, or a single number for square inputs')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()],
+                        help='CPU thread counts (torch.set_num_threads)')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=('cpu', 'cuda'))
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed iterations before measuring')
+    parser.add_argument('--iters', type=int, default=20, help='Timed iterations')
+    parser.add_argument('--output', default='benchmark_inference.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def parse_resolution(resolution):
+    h, _, w = resolution.partition('x')
+    return int(h), int(w or h)
+
+
+def count_macs(model, x):
+    macs, _ = profile(deepcopy(model), inputs=(x,), verbose=False)
+    return macs
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(setting):
+    """Measures one setting; runs in a fresh process so that the peak RSS belongs to it alone."""
+    torch.set_num_threads(setting['threads'])
+    device = torch.device(setting['device'])
+    # weights don't affect the timings, the generator is built without downloading them
+    model = get_generator({'g_name': setting['model'], 'norm_layer': NORM_LAYERS[setting['model']]},
+                          cuda=False, pretrained=False).to(device)
+    # same mode as Predictor
+    set_inference_mode(model)
+    x = torch.randn(setting['batch_size'], 3, setting['height'], setting['width'], device=device)
+
+    def forward():
+        with torch.inference_mode():
+            model(x)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    baseline_rss = max_rss_mb()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    for _ in range(setting['warmup']):
+        forward()
+    latencies = []
+    for _ in range(setting['iters']):
+        start = time.perf_counter()
+        forward()
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    result = dict(setting,
+                  latency_ms_mean=float(latencies.mean()),
+                  latency_ms_p50=float(np.percentile(latencies, 50)),
+                  latency_ms_p90=float(np.percentile(latencies, 90)),
+                  latency_ms_p99=float(np.percentile(latencies, 99)),
+                  images_per_sec=float(setting['batch_size'] * 1000 / latencies.mean()),
+                  baseline_rss_mb=baseline_rss,
+                  peak_rss_mb=max_rss_mb(),
+                  gmacs_per_image=count_macs(model, x[:1]) / 1e9)
+    if device.type == 'cuda':
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    return result
+
+
+def main():
+    args = get_args()
+    threads = args.threads if args.device == 'cpu' else [torch.get_num_threads()]
+    settings = [{'model': model, 'height': h, 'width': w, 'batch_size': batch_size, 'threads': num_threads,
+                 'device': args.device, 'warmup': args.warmup, 'iters': args.iters}
+                for model, (h, w), batch_size, num_threads in
+                product(args.models, map(parse_resolution, args.resolutions), args.batch_sizes, threads)]
+
+    results = []
+    ctx = mp.get_context('spawn')
+    for setting in settings:
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run, (setting,))
+        print('{model} {height}x{width} batch={batch_size} threads={threads}: '
+              'p50 {latency_ms_p50:.1f}ms, p99 {latency_ms_p99:.1f}ms, {images_per_sec:.2f} images/sec, '
+              'peak rss {peak_rss_mb:.0f}MB'.format(**r))
+        results.append(r)
+
+    with open(args.output, 'w') as f:
+        json.dump({'torch': torch.__version__, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import importlib
+import json
+import time
+from glob import glob
+from itertools import product
+
+import cv2
+import numpy as np
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Speed and accuracy against fp32 of reduced precision and channels_last inference')
+    parser.add_argument('--package', default='modules.GhostDeblurGAN',
+                        help='Import path of this repository, run from the directory predict.py expects')
+    parser.add_argument('--weights_path', default='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5')
+    parser.add_argument('--model', default='fpn_ghostnet_gm_hin', choices=('fpn_ghostnet_gm_hin', 'fpn_mobilenet'))
+    parser.add_argument('--norm_layer', default='hin')
+    parser.add_argument('--images', required=True, help='Glob of blurred test images, e.g. GoPro test frames')
+    parser.add_argument('--max_images', type=int, default=20)
+    parser.add_argument('--precisions', nargs='+', default=['fp32', 'bf16'], choices=('fp32', 'bf16', 'fp16'))
+    parser.add_argument('--cuda', action='store_true')
+    parser.add_argument('--min_psnr', type=float, default=40., help='Lowest acceptable mean PSNR against fp32')
+    parser.add_argument('--output', default='benchmark_precision.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    predict = importlib.import_module(args.package + '.predict')
+    metrics = importlib.import_module(args.package + '.util.metrics')
+    model_config = {'g_name': args.model, 'norm_layer': args.norm_layer}
+    images = [cv2.imread(f) for f in sorted(glob(args.images))[:args.max_images]]
+
+    def run(precision, channels_last):
+        predictor = predict.Predictor(args.weights_path, model_name=model_config, cuda=args.cuda,
+                                      precision=precision, channels_last=channels_last)
+        predictor(images[0], None, bgr=True)
+        preds, times = [], []
+        for img in images:
+            start = time.perf_counter()
+            preds.append(predictor(img, None, bgr=True))
+            times.append(time.perf_counter() - start)
+        return preds, float(np.mean(times) * 1000)
+
+    reference, reference_ms = run('fp32', False)
+    results = []
+    for precision, channels_last in product(args.precisions, (False, True)):
+        preds, ms = run(precision, channels_last)
+        psnr = [metrics.PSNR(pred, ref) for pred, ref in zip(preds, reference)]
+        r = {'precision': precision, 'channels_last': channels_last, 'ms_per_image': ms,
+             'speedup': reference_ms / ms, 'psnr_vs_fp32_mean': float(np.mean(psnr)),
+             'psnr_vs_fp32_min': float(np.min(psnr))}
+        r['ok'] = r['psnr_vs_fp32_mean'] >= args.min_psnr
+        print('{precision} channels_last={channels_last}: {ms_per_image:.1f}ms/image ({speedup:.2f}x), '
+              'PSNR vs fp32 mean {psnr_vs_fp32_mean:.2f}dB min {psnr_vs_fp32_min:.2f}dB'.format(**r)
+              + ('' if r['ok'] else f', below {args.min_psnr}dB'))
+        results.append(r)
+
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# libraries the inference entry point should not need
+HEAVY_MODULES = ['albumentations', 'yaml', 'fire', 'tqdm', 'timm', 'torchvision', 'skimage', 'tensorboardX']
+
+CHILD = '''
+import importlib, json, sys, time
+args = json.loads(sys.argv[1])
+start = time.perf_counter()
+import numpy as np
+import torch
+torch_s = time.perf_counter() - start
+Predictor = importlib.import_module(args['package'] + '.predict').Predictor
+import_s = time.perf_counter() - start
+predictor = Predictor(args['weights_path'], model_name={'g_name': args['model'], 'norm_layer': args['norm_layer']},
+                      cuda=args['cuda'])
+init_s = time.perf_counter() - start
+img = np.zeros((args['height'], args['width'], 3), dtype=np.uint8)
+frames = []
+for _ in range(2):
+    frame_start = time.perf_counter()
+    predictor(img, None)
+    frames.append(time.perf_counter() - frame_start)
+print(json.dumps({'torch_import_s': torch_s, 'import_s': import_s, 'init_s': init_s,
+                  'first_frame_s': frames[0], 'second_frame_s': frames[1], 'ready_s': init_s + frames[0],
+                  'loaded': [m for m in args['heavy_modules'] if m in sys.modules]}))
+'''
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Measure the cold start of predict.Predictor in fresh processes')
+    parser.add_argument('--package', default='modules.GhostDeblurGAN',
+                        help='Import path of this repository, run from the directory predict.py expects')
+    parser.add_argument('--weights_path', default='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5')
+    parser.add_argument('--model', default='fpn_ghostnet_gm_hin', choices=('fpn_ghostnet_gm_hin', 'fpn_mobilenet'))
+    parser.add_argument('--norm_layer', default='hin')
+    parser.add_argument('--resolution', default='720x1280', help='HxW of the frames')
+    parser.add_argument('--cuda', action='store_true')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', default='benchmark_startup.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    h, _, w = args.resolution.partition('x')
+    child_args = json.dumps({'package': args.package, 'weights_path': args.weights_path, 'model': args.model,
+                             'norm_layer': args.norm_layer, 'cuda': args.cuda, 'height': int(h),
+                             'width': int(w or h), 'heavy_modules': HEAVY_MODULES})
+    runs = []
+    for i in range(args.runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, '-c', CHILD, child_args], check=True, capture_output=True, text=True)
+        run = json.loads(out.stdout.strip().splitlines()[-1])
+        run['process_s'] = time.perf_counter() - start
+        print(f'run {i}: import {run["import_s"]:.2f}s (torch {run["torch_import_s"]:.2f}s), '
+              f'predictor {run["init_s"] - run["import_s"]:.2f}s, first frame {run["first_frame_s"]:.2f}s, '
+              f'second frame {run["second_frame_s"]:.2f}s, process {run["process_s"]:.2f}s, '
+              f'loaded {run["loaded"] or "none"} of {HEAVY_MODULES}')
+        runs.append(run)
+
+    summary = {key: float(np.median([run[key] for run in runs]))
+               for key in ('torch_import_s', 'import_s', 'init_s', 'first_frame_s', 'ready_s', 'process_s')}
+    print('median: ' + ', '.join(f'{key}={value:.2f}' for key, value in summary.items()))
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'median': summary, 'runs': runs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
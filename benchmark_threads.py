@@ -0,0 +1,91 @@
+import argparse
+import importlib
+import json
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Throughput of one Predictor shared by several caller threads')
+    parser.add_argument('--package', default='modules.GhostDeblurGAN',
+                        help='Import path of this repository, run from the directory predict.py expects')
+    parser.add_argument('--weights_path', default='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5')
+    parser.add_argument('--model', default='fpn_ghostnet_gm_hin', choices=('fpn_ghostnet_gm_hin', 'fpn_mobilenet'))
+    parser.add_argument('--norm_layer', default='hin')
+    parser.add_argument('--resolution', default='720x1280', help='HxW of the frames')
+    parser.add_argument('--callers', type=int, nargs='+', default=[1, 2, 4], help='Numbers of caller threads')
+    parser.add_argument('--torch_threads', type=int, default=torch.get_num_threads(), help='torch.set_num_threads')
+    parser.add_argument('--frames', type=int, default=20, help='Frames per caller thread')
+    parser.add_argument('--cuda', action='store_true')
+    parser.add_argument('--output', default='benchmark_threads.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def run_callers(predictor, frames, num_callers, frames_per_caller):
+    latencies = [[] for _ in range(num_callers)]
+
+    def caller(i):
+        for j in range(frames_per_caller):
+            start = time.perf_counter()
+            predictor(frames[(i + j) % len(frames)], None)
+            latencies[i].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(num_callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.concatenate(latencies) * 1000
+    return {'callers': num_callers,
+            'frames_per_sec': num_callers * frames_per_caller / elapsed,
+            'latency_ms_p50': float(np.percentile(latencies, 50)),
+            'latency_ms_p90': float(np.percentile(latencies, 90))}
+
+
+def main():
+    args = get_args()
+    torch.set_num_threads(args.torch_threads)
+    predict = importlib.import_module(args.package + '.predict')
+    metrics = importlib.import_module(args.package + '.util.metrics')
+    model_config = {'g_name': args.model, 'norm_layer': args.norm_layer}
+    predictor = predict.Predictor(args.weights_path, model_name=model_config, cuda=args.cuda)
+
+    h, _, w = args.resolution.partition('x')
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 256, (int(h), int(w or h), 3), dtype=np.uint8) for _ in range(4)]
+    for frame in frames[:2]:
+        predictor(frame, None)
+
+    results = []
+    for num_callers in args.callers:
+        r = run_callers(predictor, frames, num_callers, args.frames)
+        print('{callers} callers: {frames_per_sec:.2f} frames/sec, p50 {latency_ms_p50:.1f}ms, '
+              'p90 {latency_ms_p90:.1f}ms'.format(**r))
+        results.append(r)
+
+    # results have to match single threaded calls, and the former train mode up to the BatchNorm change
+    expected = [predictor(frame, None) for frame in frames]
+    concurrent = [None] * len(frames)
+    threads = [threading.Thread(target=lambda i: concurrent.__setitem__(i, predictor(frames[i], None)), args=(i,))
+               for i in range(len(frames))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    legacy = predict.Predictor(args.weights_path, model_name=model_config, cuda=args.cuda, train_mode=True)
+    checks = {'concurrent_identical': all(np.array_equal(a, b) for a, b in zip(expected, concurrent)),
+              'psnr_vs_train_mode': float(np.mean([metrics.PSNR(a, legacy(frame, None))
+                                                   for a, frame in zip(expected, frames)]))}
+    print(checks)
+
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'results': results, 'checks': checks}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import json
+import multiprocessing as mp
+import random
+import tempfile
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+import yaml
+
+from train import Trainer
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Peak memory and losses of the training step, against the former step')
+    parser.add_argument('--config', default='config/config.yaml')
+    parser.add_argument('--d_name', default='double_gan')
+    parser.add_argument('--disc_loss', default='ragan-ls')
+    parser.add_argument('--crop', type=int, default=256)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--steps', type=int, default=10, help='Steps per run, the losses of all steps are compared')
+    parser.add_argument('--output', default='benchmark_train_step.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def legacy_update_d(trainer):
+    """Trainer._update_d as it was: retain_graph=True."""
+    def update_d(outputs, targets):
+        if trainer.config['model']['d_name'] == 'no_gan':
+            return 0
+        trainer.optimizer_D.zero_grad()
+        loss_D = trainer.adv_lambda * trainer.adv_trainer.loss_d(outputs, targets)
+        loss_D.backward(retain_graph=True)
+        trainer.optimizer_D.step()
+        return loss_D.item()
+    return update_d
+
+
+def run(setting):
+    """Runs training steps on random crops in a fresh process and records the peak CUDA memory."""
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+    device = torch.device('cuda')
+    with open(setting['config']) as f:
+        config = yaml.safe_load(f)
+    config['model'].update(d_name=setting['d_name'], disc_loss=setting['disc_loss'])
+    config['experiment_desc'] = tempfile.mkdtemp()
+    trainer = Trainer(config, train=None, val=None, device=device)
+    trainer._init_params()
+    if setting['legacy']:
+        trainer._update_d = legacy_update_d(trainer)
+        trainer._frozen_d = nullcontext
+
+    shape = (setting['batch_size'], 3, setting['crop'], setting['crop'])
+    batches = [{'a': torch.rand(shape) * 2 - 1, 'b': torch.rand(shape) * 2 - 1} for _ in range(setting['steps'])]
+    trainer._train_step(batches[0])
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats(device)
+    for data in batches[1:]:
+        trainer._train_step(data)
+    torch.cuda.synchronize()
+    metrics = trainer.metric_counter.metrics
+    return dict(setting, peak_cuda_mb=torch.cuda.max_memory_allocated(device) / 2 ** 20,
+                G_loss=metrics['G_loss'].values().tolist(), D_loss=metrics['D_loss'].values().tolist())
+
+
+def main():
+    args = get_args()
+    results = []
+    ctx = mp.get_context('spawn')
+    for legacy in (True, False):
+        setting = dict(vars(args), legacy=legacy)
+        with ctx.Pool(1) as pool:
+            r = pool.apply(run, (setting,))
+        print('{} step: peak {:.0f}MB'.format('former' if legacy else 'current', r['peak_cuda_mb']))
+        results.append(r)
+
+    former, current = results
+    identical = {name: bool(np.allclose(former[name], current[name], rtol=1e-5, atol=1e-6))
+                 for name in ('G_loss', 'D_loss')}
+    saved = former['peak_cuda_mb'] - current['peak_cuda_mb']
+    print(f'peak memory saved: {saved:.0f}MB ({saved / former["peak_cuda_mb"]:.1%}), losses identical: {identical}')
+    with open(args.output, 'w') as f:
+        json.dump({'results': results, 'identical_losses': identical, 'saved_mb': saved}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+import json
+import multiprocessing as mp
+from itertools import product
+
+import torch
+
+from benchmark_checkpointing import run
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Generator training steps with a frozen backbone, with and without fast_warmup')
+    parser.add_argument('--crops', type=int, nargs='+', default=[256, 512], help='Square crop sizes')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=('cpu', 'cuda'))
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed steps before measuring')
+    parser.add_argument('--iters', type=int, default=10, help='Timed steps')
+    parser.add_argument('--output', default='benchmark_warmup.json', help='Json file for the results')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    results = []
+    ctx = mp.get_context('spawn')
+    for crop, batch_size in product(args.crops, args.batch_sizes):
+        pair = []
+        for fast_warmup in (False, True):
+            setting = {'crop': crop, 'batch_size': batch_size, 'checkpointing': False, 'frozen': True,
+                       'fast_warmup': fast_warmup, 'device': args.device, 'warmup': args.warmup,
+                       'iters': args.iters}
+            with ctx.Pool(1) as pool:
+                pair.append(pool.apply(run, (setting,)))
+        slow, fast = pair
+        memory = 'peak_cuda_mb' if 'peak_cuda_mb' in fast else 'peak_rss_mb'
+        print(f'crop={crop} batch={batch_size}: {slow["samples_per_sec"]:.2f} -> {fast["samples_per_sec"]:.2f} '
+              f'samples/sec ({fast["samples_per_sec"] / slow["samples_per_sec"]:.2f}x), '
+              f'peak memory {slow[memory]:.0f} -> {fast[memory]:.0f}MB')
+        results += pair
+
+    with open(args.output, 'w') as f:
+        json.dump({'torch': torch.__version__, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
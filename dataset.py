@@ -1,4 +1,5 @@
 import os
+import random
 from copy import deepcopy
 from functools import partial
 from glob import glob
@@ -7,13 +8,16 @@ from typing import Callable, Iterable, Optional, Tuple
 
 import cv2
 import numpy as np
+import torch
 from glog import logger
 from joblib import Parallel, cpu_count, delayed
 from skimage.io import imread
-from torch.utils.data import Dataset
+from torch.utils.data import DataLoader, Dataset, Sampler
+from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
 
 import aug
+from util.distributed import broadcast
 
 
 def subsample(data: Iterable, bounds: Tuple[float, float], hash_fn: Callable, n_buckets=100, salt='', verbose=True):
@@ -140,3 +144,88 @@ class PairedDataset(Dataset):
                              normalize_fn=normalize_fn,
                              transform_fn=transform_fn,
                              verbose=verbose)
+
+
+def shuffle_seed(seed: Optional[int] = None) -> int:
+    """`seed`, or without one a random seed shared by all ranks, which shard the same permutation.
+    Collective in distributed training, every rank has to call it."""
+    if seed is not None:
+        return seed
+    return broadcast(random.SystemRandom().randrange(2 ** 62))
+
+
+class InfiniteSampler(Sampler):
+    """Yields dataset indices forever, reshuffling after every pass, for step based training.
+    Every rank draws from its own shard of the permutation, like DistributedSampler does. Without a
+    seed the order differs from run to run."""
+
+    def __init__(self, dataset: Dataset, shuffle: bool = True, seed: Optional[int] = None, rank: int = 0,
+                 world_size: int = 1):
+        self.size = len(dataset)
+        self.shuffle = shuffle
+        self.seed = shuffle_seed(seed)
+        self.rank = rank
+        self.world_size = world_size
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed)
+        while True:
+            if self.shuffle:
+                indices = torch.randperm(self.size, generator=generator)
+            else:
+                indices = torch.arange(self.size)
+            yield from indices[self.rank::self.world_size].tolist()
+
+
+def seed_worker(worker_id: int):
+    # torch seeds every worker with base_seed + worker_id, albumentations draws from random and numpy
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def get_dataloader(dataset: Dataset,
+                   batch_size: int,
+                   num_workers: Optional[int] = None,
+                   persistent_workers: bool = True,
+                   prefetch_factor: int = 2,
+                   pin_memory: bool = True,
+                   seed: Optional[int] = None,
+                   shuffle: bool = True,
+                   drop_last: bool = True,
+                   rank: int = 0,
+                   world_size: int = 1,
+                   infinite: bool = False) -> DataLoader:
+    """Builds a DataLoader from the `dataloader` block of the config.
+
+    num_workers=None uses all CPU cores, split between `world_size` training processes. With a seed,
+    shuffling and augmentations are reproducible for a given seed, rank and worker count. An infinite
+    loader never ends an epoch, it is used by the step based training mode.
+    """
+    if num_workers is None:
+        num_workers = max(1, cpu_count() // world_size)
+    generator = None
+    if seed is not None:
+        generator = torch.Generator()
+        generator.manual_seed(seed + rank)
+
+    sampler = None
+    if infinite:
+        sampler = InfiniteSampler(dataset, shuffle=shuffle, seed=seed, rank=rank, world_size=world_size)
+    elif world_size > 1:
+        sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=shuffle,
+                                     seed=shuffle_seed(seed))
+    # prefetch_factor and persistent_workers are rejected by DataLoader without worker processes
+    worker_kwargs = {'persistent_workers': persistent_workers,
+                     'prefetch_factor': prefetch_factor} if num_workers > 0 else {}
+    return DataLoader(dataset,
+                      batch_size=batch_size,
+                      shuffle=shuffle and sampler is None,
+                      sampler=sampler,
+                      num_workers=num_workers,
+                      pin_memory=pin_memory and torch.cuda.is_available(),
+                      drop_last=drop_last,
+                      worker_init_fn=seed_worker if seed is not None else None,
+                      generator=generator,
+                      **worker_kwargs)
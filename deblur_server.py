@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+from fire import Fire
+
+ENCODINGS = {'png': ('.png', 'image/png'),
+             'jpg': ('.jpg', 'image/jpeg'),
+             'jpeg': ('.jpg', 'image/jpeg')}
+
+
+class _Request:
+    def __init__(self, img: np.ndarray):
+        self.img = img
+        self.arrival = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ServerStats:
+    """Throughput and latency counters, latencies are kept for the last `window` frames."""
+
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.frames = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=window)
+        self.finished = deque(maxlen=window)
+
+    def record(self, requests, failed=False):
+        now = time.monotonic()
+        with self.lock:
+            self.batches += 1
+            self.frames += len(requests)
+            self.errors += len(requests) if failed else 0
+            for request in requests:
+                self.latencies.append(now - request.arrival)
+                self.finished.append(now)
+
+    def summary(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            latencies = np.array(self.latencies) * 1000
+            summary = {'uptime_s': now - self.start,
+                       'frames': self.frames,
+                       'batches': self.batches,
+                       'errors': self.errors,
+                       'mean_batch_size': self.frames / max(1, self.batches),
+                       'frames_per_sec': self.frames / (now - self.start)}
+            if len(self.finished) > 1 and self.finished[-1] > self.finished[0]:
+                summary['recent_frames_per_sec'] = (len(self.finished) - 1) / (self.finished[-1] - self.finished[0])
+            if len(latencies):
+                summary.update(latency_ms_p50=float(np.percentile(latencies, 50)),
+                               latency_ms_p90=float(np.percentile(latencies, 90)),
+                               latency_ms_p99=float(np.percentile(latencies, 99)))
+            return summary
+
+
+class DynamicBatcher:
+    """Queues frames from any number of threads and runs them through one Predictor (anything with
+    predict_batch) in batches.
+
+    Frames are grouped by resolution. A group runs as soon as it holds `max_batch_size` frames or
+    its oldest frame has waited `max_wait` seconds; full groups are served first, then the others
+    oldest first. `bgr` is the channel order of the frames.
+    """
+
+    def __init__(self, predictor, max_batch_size: int = 8, max_wait: float = 0.01, bgr: bool = False):
+        self.predictor = predictor
+        self.bgr = bgr
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = ServerStats()
+        self.pending = {}
+        self.cond = threading.Condition()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        """Deblurs a frame, blocking until its batch has run."""
+        request = _Request(img)
+        with self.cond:
+            self.pending.setdefault(img.shape, []).append(request)
+            self.cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next_batch(self):
+        with self.cond:
+            while True:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+                # a full group runs at once, even while an older partial one is still waiting
+                full = [item for item in self.pending.items() if len(item[1]) >= self.max_batch_size]
+                shape, requests = min(full or self.pending.items(), key=lambda x: x[1][0].arrival)
+                wait = requests[0].arrival + self.max_wait - time.monotonic()
+                if full or wait <= 0:
+                    batch, rest = requests[:self.max_batch_size], requests[self.max_batch_size:]
+                    if rest:
+                        self.pending[shape] = rest
+                    else:
+                        del self.pending[shape]
+                    return batch
+                self.cond.wait(wait)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.predictor.predict_batch([request.img for request in batch], bgr=self.bgr)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                self.stats.record(batch, failed=True)
+                continue
+            for request, result in zip(batch, results):
+                request.result = result
+                request.done.set()
+            self.stats.record(batch)
+
+
+def make_handler(batcher: DynamicBatcher):
+    class DeblurHandler(BaseHTTPRequestHandler):
+        """GET /health, GET /stats, and POST /deblur?format=png|jpg|raw.
+
+        The body of /deblur is an encoded image, or raw BGR bytes with ?width=&height=. Raw results
+        are returned as BGR bytes with X-Width and X-Height headers.
+        """
+
+        def _reply(self, code: int, body: bytes, content_type: str, headers: Optional[dict] = None):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _reply_json(self, code: int, data: dict):
+            self._reply(code, json.dumps(data).encode(), 'application/json')
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                self._reply_json(200, {'status': 'ok'})
+            elif path == '/stats':
+                self._reply_json(200, batcher.stats.summary())
+            else:
+                self._reply_json(404, {'error': f'unknown path {path}'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/deblur':
+                return self._reply_json(404, {'error': f'unknown path {url.path}'})
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            fmt = query.get('format', 'png')
+            if fmt != 'raw' and fmt not in ENCODINGS:
+                return self._reply_json(400, {'error': f'unknown format {fmt}'})
+
+            if 'width' in query or 'height' in query:
+                try:
+                    shape = (int(query['height']), int(query['width']), 3)
+                except (KeyError, ValueError):
+                    return self._reply_json(400, {'error': 'raw frames need integer width and height'})
+                if min(shape) <= 0 or len(body) != np.prod(shape):
+                    return self._reply_json(400, {'error': 'raw body does not match width x height x 3'})
+                img = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+            else:
+                img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    return self._reply_json(400, {'error': 'can not decode image'})
+
+            try:
+                pred = batcher(img)
+            except Exception as e:
+                # the whole batch failed, see ServerStats.errors
+                return self._reply_json(500, {'error': f'{type(e).__name__}: {e}'})
+            h, w = pred.shape[:2]
+            if fmt == 'raw':
+                return self._reply(200, pred.tobytes(), 'application/octet-stream', {'X-Width': w, 'X-Height': h})
+            ext, content_type = ENCODINGS[fmt]
+            _, encoded = cv2.imencode(ext, pred)
+            self._reply(200, encoded.tobytes(), content_type)
+
+        def log_message(self, format, *args):
+            pass
+
+    return DeblurHandler
+
+
+def main(weights_path='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5',
+         host: str = '127.0.0.1',
+         port: int = 8080,
+         max_batch_size: int = 8,
+         max_wait_ms: float = 10,
+         warmup_size: str = '720x1280',
+         cuda: bool = True):
+    from .predict import Predictor
+    predictor = Predictor(weights_path=weights_path, cuda=cuda)
+    h, _, w = warmup_size.partition('x')
+    # the first passes at a resolution are slow (allocator, cudnn autotuning), run them before serving
+    for _ in range(2):
+        predictor.predict_batch([np.zeros((int(h), int(w or h), 3), dtype=np.uint8)])
+    batcher = DynamicBatcher(predictor, max_batch_size=max_batch_size, max_wait=max_wait_ms / 1000, bgr=True)
+    server = ThreadingHTTPServer((host, port), make_handler(batcher))
+    print(f'serving on http://{host}:{port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    Fire(main)
@@ -1,56 +1,223 @@
 import logging
-from collections import defaultdict
+import math
+import queue
+import threading
 
 import numpy as np
 from tensorboardX import SummaryWriter
 
+from util.distributed import all_gather
+
 WINDOW_SIZE = 100
 
 
+class RunningMetric:
+    """Mean and std over all values added since the last reset (Welford) and mean over the last
+    `window` values (a ring buffer with a running sum). Adding a value and reading any of the
+    aggregates are O(1), however many values were added."""
+
+    def __init__(self, window: int = WINDOW_SIZE):
+        self.buffer = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.window_sum = 0.
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        pos = (self.count - 1) % len(self.buffer)
+        if self.count > len(self.buffer):
+            self.window_sum -= self.buffer[pos]
+        self.buffer[pos] = value
+        self.window_sum += value
+        if pos == len(self.buffer) - 1:
+            # once per window, so the rounding errors of the running sum don't accumulate
+            self.window_sum = float(self.buffer.sum())
+
+    def merge(self, other: 'RunningMetric'):
+        """Adds the values of another metric as if they had been added after these (Chan et al.).
+        The window keeps the last values of the concatenation."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        values = np.concatenate([self.values(), other.values()])[-len(self.buffer):]
+        self.count = count
+        # the ring position of add() follows the count
+        self.buffer[:len(values)] = values
+        if count > len(self.buffer):
+            self.buffer = np.roll(self.buffer, count % len(self.buffer))
+        self.window_sum = float(values.sum())
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    def total_mean(self):
+        return self.mean if self.count else math.nan
+
+    def window_mean(self):
+        n = min(self.count, len(self.buffer))
+        return self.window_sum / n if n else math.nan
+
+    def values(self) -> np.ndarray:
+        """The last `window` values, oldest first."""
+        if self.count <= len(self.buffer):
+            return self.buffer[:self.count].copy()
+        pos = self.count % len(self.buffer)
+        return np.concatenate([self.buffer[pos:], self.buffer[:pos]])
+
+    def __len__(self):
+        return self.count
+
+
+class BackgroundWriter:
+    """Runs tensorboard and log calls on a daemon thread in submission order, so the training loop
+    never waits for event files, image encoding or the log file."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        self.queue.put((fn, args, kwargs))
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self.queue.get()
+            try:
+                if fn is None:
+                    return
+                fn(*args, **kwargs)
+            except Exception:
+                logging.exception('metric writer failed')
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Blocks until everything submitted so far has been written."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put((None, (), {}))
+        self.thread.join()
+
+
 class MetricCounter:
-    def __init__(self, exp_name):
-        self.writer = SummaryWriter(exp_name)
-        logging.basicConfig(filename='{}.log'.format(exp_name), level=logging.DEBUG)
-        self.metrics = defaultdict(list)
-        self.images = defaultdict(list)
+    def __init__(self, exp_name, write=True, window=WINDOW_SIZE):
+        # in distributed training only the main process owns the tensorboard writer and the log file
+        self.write = write
+        self.window = window
+        self.writer = SummaryWriter(exp_name) if write else None
+        self.background = BackgroundWriter() if write else None
+        if write:
+            logging.basicConfig(filename='{}.log'.format(exp_name), level=logging.DEBUG)
+        self.metrics = {}
+        self.images = {}
         self.best_metric = 0
 
+    def _add(self, name, value):
+        if name not in self.metrics:
+            self.metrics[name] = RunningMetric(self.window)
+        self.metrics[name].add(value)
+
+    def _mean(self, name, window=False):
+        metric = self.metrics.get(name)
+        if metric is None:
+            return math.nan
+        return metric.window_mean() if window else metric.total_mean()
+
+    def synchronize(self):
+        """Merges the metrics of all training processes, in rank order, so every rank logs and compares
+        the means over the whole (sharded) validation set. Collective in distributed training."""
+        gathered = all_gather(self.metrics)
+        if len(gathered) == 1:
+            return
+        self.metrics = {}
+        for metrics in gathered:
+            for name, metric in metrics.items():
+                self.metrics.setdefault(name, RunningMetric(self.window)).merge(metric)
+
     def add_image(self, x: np.ndarray, tag: str):
-        self.images[tag].append(x)
+        self.images.setdefault(tag, []).append(x)
 
     def clear(self):
-        self.metrics = defaultdict(list)
-        self.images = defaultdict(list)
+        self.metrics = {}
+        self.images = {}
 
     def add_losses(self, l_G, l_content, l_D=0):
         for name, value in zip(('G_loss', 'G_loss_content', 'G_loss_adv', 'D_loss'),
                                (l_G, l_content, l_G - l_content, l_D)):
-            self.metrics[name].append(value)
+            self._add(name, value)
+
+    def add_d_loss(self, l_D):
+        # discriminator only steps, see model.d_updates_per_g
+        self._add('D_loss', l_D)
 
     def add_metrics(self, psnr, ssim):
         for name, value in zip(('PSNR', 'SSIM'),
                                (psnr, ssim)):
-            self.metrics[name].append(value)
+            self._add(name, value)
 
     def loss_message(self):
-        metrics = ((k, np.mean(self.metrics[k][-WINDOW_SIZE:])) for k in ('G_loss', 'PSNR', 'SSIM'))
+        metrics = ((k, self._mean(k, window=True)) for k in ('G_loss', 'PSNR', 'SSIM'))
         return '; '.join(map(lambda x: f'{x[0]}={x[1]:.4f}', metrics))
 
+    def log(self, message):
+        """logging.debug on the writer thread."""
+        if self.write:
+            self.background.submit(logging.debug, message)
+
     def write_to_tensorboard(self, epoch_num, validation=False):
+        if not self.write:
+            return
         scalar_prefix = 'Validation' if validation else 'Train'
         for tag in ('G_loss', 'D_loss', 'G_loss_adv', 'G_loss_content', 'SSIM', 'PSNR'):
-            self.writer.add_scalar(f'{scalar_prefix}_{tag}', np.mean(self.metrics[tag]), global_step=epoch_num)
-        for tag in self.images:
-            imgs = self.images[tag]
+            self.background.submit(self.writer.add_scalar, f'{scalar_prefix}_{tag}', self._mean(tag),
+                                   global_step=epoch_num)
+        for tag, imgs in self.images.items():
             if imgs:
-                imgs = np.array(imgs)
-                self.writer.add_images(tag, imgs[:, :, :, ::-1].astype('float32') / 255, dataformats='NHWC',
-                                       global_step=epoch_num)
-                self.images[tag] = []
+                self.background.submit(self._write_images, tag, imgs, epoch_num)
+        # the writer thread owns the submitted lists now
+        self.images = {}
+
+    def _write_images(self, tag, imgs, step):
+        imgs = np.array(imgs)
+        self.writer.add_images(tag, imgs[:, :, :, ::-1].astype('float32') / 255, dataformats='NHWC',
+                               global_step=step)
+
+    def write_timings(self, timings, step):
+        """Writes stage timings (name -> array of seconds, see util.timing.StageTimer.histograms)."""
+        if not self.write:
+            return
+        for name, times in timings.items():
+            if len(times):
+                self.background.submit(self.writer.add_scalar, f'Timing_{name}_ms', np.mean(times) * 1000,
+                                       global_step=step)
+                self.background.submit(self.writer.add_histogram, f'Timing_{name}', times * 1000,
+                                       global_step=step)
 
     def update_best_model(self):
-        cur_metric = np.mean(self.metrics['PSNR'])
+        cur_metric = self._mean('PSNR')
         if self.best_metric < cur_metric:
             self.best_metric = cur_metric
             return True
         return False
+
+    def flush(self):
+        if self.write:
+            self.background.flush()
+            self.writer.flush()
+
+    def close(self):
+        if self.write:
+            self.background.close()
+            self.writer.close()
@@ -1,9 +1,48 @@
 import math
+from contextlib import contextmanager, nullcontext
+
 import torch
 import torch.nn as nn
-import timm
-import numpy as np
-import cv2
+from torch.utils.checkpoint import checkpoint
+
+
+@contextmanager
+def frozen_running_stats(module):
+    """BatchNorm layers of `module` normalise as usual but leave their running statistics alone."""
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    # a forward in train mode also counts num_batches_tracked, and a BN with momentum=None averages
+    # with 1 / num_batches_tracked, so the buffers themselves are restored rather than the momentum zeroed
+    saved = [(bn.running_mean.clone(), bn.running_var.clone(), bn.num_batches_tracked.clone()) for bn in bns]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for bn, (mean, var, num_batches) in zip(bns, saved):
+                bn.running_mean.copy_(mean)
+                bn.running_var.copy_(var)
+                bn.num_batches_tracked.copy_(num_batches)
+
+
+def checkpointed(module, *inputs):
+    """Runs `module` without keeping its intermediate activations for backward, they are recomputed
+    during the backward pass instead."""
+    if not any(x.requires_grad for x in inputs):
+        if not any(p.requires_grad for p in module.parameters()):
+            # e.g. the frozen backbone, no graph is kept anyway
+            return module(*inputs)
+        # the (reentrant) checkpoint only backpropagates into parameters when an input requires grad
+        inputs = [x.detach().requires_grad_() for x in inputs]
+    calls = []
+
+    def run(*inputs):
+        if calls:
+            # recomputation during backward, the running statistics were updated by the first pass
+            with frozen_running_stats(module):
+                return module(*inputs)
+        calls.append(True)
+        return module(*inputs)
+
+    return checkpoint(run, *inputs)
 
 
 class HINet(nn.Module):
@@ -67,11 +106,14 @@ class FPNHead(nn.Module):
 
 class FPNGhostNet(nn.Module):
 
-    def __init__(self, norm_layer, output_ch=3, num_filters= 64, num_filters_fpn= 128, pretrained=True):
+    def __init__(self, norm_layer, output_ch=3, num_filters= 64, num_filters_fpn= 128, pretrained=True,
+                 checkpointing=False, fast_warmup=False):
         super(FPNGhostNet, self).__init__()
         
 
-        self.fpn = FPN(num_filters=num_filters_fpn, norm_layer=norm_layer, pretrained=pretrained)
+        self.fpn = FPN(num_filters=num_filters_fpn, norm_layer=norm_layer, pretrained=pretrained,
+                       fast_warmup=fast_warmup)
+        self.set_checkpointing(checkpointing)
 
         # The segmentation heads on top of the FPN
 
@@ -98,40 +140,64 @@ class FPNGhostNet(nn.Module):
     def unfreeze(self):
         self.fpn.unfreeze()
 
-    def forward(self, x):
-        
-        map0, map1, map2, map3, map4 = self.fpn(x)
-
-        map4 = nn.functional.interpolate(self.head4(map4), scale_factor= 8, mode="nearest")
-        map3 = nn.functional.interpolate(self.head3(map3), scale_factor=4, mode="nearest")
-        map2 = nn.functional.interpolate(self.head2(map2), scale_factor=2, mode="nearest")
-        map1 = nn.functional.interpolate(self.head1(map1), scale_factor=1, mode="nearest")
-
+    def set_checkpointing(self, enabled=True):
+        """Activation checkpointing of the encoder stages, the FPN heads and the smoothing blocks in
+        training: their activations are recomputed in backward instead of stored, which trades
+        roughly one more forward pass for memory, see benchmark_checkpointing.py."""
+        self.checkpointing = enabled
+        self.fpn.checkpointing = enabled
 
+    def _run(self, module, *inputs):
+        if self.checkpointing and self.training and torch.is_grad_enabled():
+            return checkpointed(module, *inputs)
+        return module(*inputs)
 
-        
-
-        smoothed = self.smooth(torch.cat([map4, map3, map2, map1], dim=1))
+    def forward(self, x):
+        output, _ = self.forward_reuse(x)
+        return output
+
+    def forward_reuse(self, x, coarse=None):
+        """Forward pass that also returns the coarse pyramid features: map3 and the upsampled
+        head3/head4 outputs. Passing them back for a similar frame of the same size skips the encoder
+        stages enc3/enc4, the coarse FPN levels and their heads; only the fine levels are recomputed."""
+
+        enc0, enc1, enc2 = self.fpn.encode_fine(x)
+        if coarse is None:
+            map3, map4 = self.fpn.encode_coarse(enc2)
+            coarse = (map3,
+                      nn.functional.interpolate(self._run(self.head3, map3), scale_factor=4, mode="nearest"),
+                      nn.functional.interpolate(self._run(self.head4, map4), scale_factor= 8, mode="nearest"))
+        map3, head3, head4 = coarse
+        map0, map1, map2 = self.fpn.top_down(enc0, enc1, enc2, map3)
+
+        map2 = nn.functional.interpolate(self._run(self.head2, map2), scale_factor=2, mode="nearest")
+        map1 = nn.functional.interpolate(self._run(self.head1, map1), scale_factor=1, mode="nearest")
+
+        smoothed = self._run(self.smooth, torch.cat([head4, head3, map2, map1], dim=1))
         smoothed = nn.functional.interpolate(smoothed, scale_factor=2, mode="nearest")
-        smoothed = self.smooth2(smoothed + map0)
+        smoothed = self._run(self.smooth2, smoothed + map0)
         smoothed = nn.functional.interpolate(smoothed, scale_factor=2, mode="nearest") 
 
         final = self.final(smoothed)
         res = torch.tanh(final) + x
 
-        return torch.clamp(res, min=-1, max=1)
+        return torch.clamp(res, min=-1, max=1), coarse
 
 class FPN(nn.Module):
 
-    def __init__(self, norm_layer, num_filters= 128, pretrained=True):
+    def __init__(self, norm_layer, num_filters= 128, pretrained=True, fast_warmup=False):
         """Creates an `FPN` instance for feature extraction.
         Args:
           num_filters: the number of filters in each output pyramid level
           pretrained: use ImageNet pre-trained backbone feature extractor
+          fast_warmup: while the backbone is frozen, run it without autograd and with its BatchNorm
+            layers in eval mode, so none of its activations are stored for backward
         """
         
         super(FPN, self).__init__()
-        model = timm.create_model('ghostnet_100', pretrained= True, features_only= True)
+        # timm (and torchvision with it) takes longer to import than the rest of the model code
+        import timm
+        model = timm.create_model('ghostnet_100', pretrained= pretrained, features_only= True)
         
         self.features= model
         
@@ -160,54 +226,87 @@ class FPN(nn.Module):
 
         for param in self.features.parameters():
             param.requires_grad = False
+        self.frozen = True
+        self.fast_warmup = fast_warmup
+        # see FPNGhostNet.set_checkpointing
+        self.checkpointing = False
+        # the backbone BatchNorm layers start out frozen, not only after the next train() call
+        self.train(self.training)
 
     def unfreeze(self):
         for param in self.features.parameters():
             param.requires_grad = True
+        self.frozen = False
+        # BatchNorm of the backbone follows the mode of the model again
+        self.train(self.training)
+
+    def train(self, mode=True):
+        super(FPN, self).train(mode)
+        if self.frozen and self.fast_warmup:
+            self.features.eval()
+        return self
+
+    def _encoder(self):
+        return torch.no_grad() if self.frozen and self.fast_warmup else nullcontext()
+
+    def _run(self, module, *inputs):
+        if self.checkpointing and self.training and torch.is_grad_enabled():
+            return checkpointed(module, *inputs)
+        return module(*inputs)
 
     def forward(self, x):
 
-        
-        
-        enc0 = self.enc0(x)
+        enc0, enc1, enc2 = self.encode_fine(x)
+        map3, map4 = self.encode_coarse(enc2)
+        lateral0, map1, map2 = self.top_down(enc0, enc1, enc2, map3)
+        return lateral0, map1, map2, map3, map4
 
-        enc1 = self.enc1(enc0)  
+    def encode_fine(self, x):
+        """Encoder stages at 1/2, 1/4 and 1/8 of the input resolution."""
 
-        enc2 = self.enc2(enc1)  
+        with self._encoder():
+            enc0 = self._run(self.enc0, x)
 
-        enc3 = self.enc3(enc2)  
+            enc1 = self._run(self.enc1, enc0)  
 
-        enc4 = self.enc4(enc3)  
+            enc2 = self._run(self.enc2, enc1)  
 
+        return enc0, enc1, enc2
 
-        # Lateral connections
+    def encode_coarse(self, enc2):
+        """Encoder stages and pyramid levels at 1/16 (map3) and 1/32 (map4) of the input resolution."""
+
+        with self._encoder():
+            enc3 = self._run(self.enc3, enc2)  
+
+            enc4 = self._run(self.enc4, enc3)  
 
         lateral4 = self.lateral4(enc4)
         lateral3 = self.lateral3(enc3)
+
+        map4 = lateral4
+        map3 = self.td1(lateral3 + nn.functional.interpolate(lateral4, scale_factor= 2, mode= "nearest"))
+        return map3, map4
+
+    def top_down(self, enc0, enc1, enc2, map3):
+        """Fine pyramid levels, continuing the top-down pathway from map3."""
+
+        # Lateral connections
         lateral2 = self.lateral2(enc2)
         lateral1 = self.lateral1(enc1)
         lateral0 = self.lateral0(enc0)
 
         # Top-down pathway
-        map4 = lateral4
-
-        map3 = self.td1(lateral3 + nn.functional.interpolate(lateral4, scale_factor= 2, mode= "nearest"))
         map2 = self.td2(lateral2 + nn.functional.interpolate(map3, scale_factor=2, mode="nearest"))
         map1 = self.td3(lateral1 + nn.functional.interpolate(map2, scale_factor=2, mode="nearest"))
-        return lateral0, map1, map2, map3, map4
-
-
-
-
-
-if __name__== "__main__":
-
-    from torchstat import stat
-    model= FPNGhostNet(nn.BatchNorm2d)
-    stat(model, (3, 736, 1312))
-
+        return lateral0, map1, map2
 
 
 
 
 
+if __name__ == "__main__":
+    # python -m models.fpn_ghostnet [options of profile_layers.py]
+    import sys
+    from profile_layers import main
+    main(['--model', 'fpn_ghostnet_gm_hin'] + sys.argv[1:])
@@ -154,11 +154,8 @@ class FPN(nn.Module):
 
 
 
-if __name__== "__main__":
-
-    
-    model =  FPNMobileNet(nn.BatchNorm2d)    
-    from torchstat import stat
-    stat(model, (3, 736, 1312))
-    
-
+if __name__ == "__main__":
+    # python -m models.fpn_mobilenet [options of profile_layers.py]
+    import sys
+    from profile_layers import main
+    main(['--model', 'fpn_mobilenet'] + sys.argv[1:])
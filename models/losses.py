@@ -7,7 +7,6 @@ from torch.autograd import Variable
 
 from util.image_pool import ImagePool
 
-torch.cuda.set_device(0)
 ###############################################################################
 # Functions
 ###############################################################################
@@ -25,12 +24,12 @@ class ContentLoss():
 
 class PerceptualLoss():
 
-    def contentFunc(self):
+    def contentFunc(self, device):
         conv_3_3_layer = 14
         cnn = models.vgg19(pretrained=True).features
-        cnn = cnn.cuda(0)
+        cnn = cnn.to(device)
         model = nn.Sequential()
-        model = model.cuda(0)
+        model = model.to(device)
         model = model.eval()
         for i, layer in enumerate(list(cnn)):
             model.add_module(str(i), layer)
@@ -38,10 +37,10 @@ class PerceptualLoss():
                 break
         return model
 
-    def initialize(self, loss):
+    def initialize(self, loss, device='cuda'):
         with torch.no_grad():
             self.criterion = loss
-            self.contentFunc = self.contentFunc()
+            self.contentFunc = self.contentFunc(device)
             self.transform = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 
     def get_loss(self, fakeIm, realIm):
@@ -88,7 +87,7 @@ class GANLoss(nn.Module):
                 fake_tensor = self.Tensor(input.size()).fill_(self.fake_label)
                 self.fake_label_var = Variable(fake_tensor, requires_grad=False)
             target_tensor = self.fake_label_var
-        return target_tensor.cuda(0)
+        return target_tensor.to(input.device)
 
     def __call__(self, input, target_is_real):
         target_tensor = self.get_target_tensor(input, target_is_real)
@@ -234,9 +233,13 @@ class DiscLossWGANGP(DiscLossLS):
     def name(self):
         return 'DiscLossWGAN-GP'
 
-    def __init__(self):
+    def __init__(self, gp_every=1):
         super(DiscLossWGANGP, self).__init__()
         self.LAMBDA = 10
+        # lazy regularization: the penalty is computed on every gp_every-th D step only, weighted by
+        # gp_every so that its average strength stays the same
+        self.gp_every = gp_every
+        self.steps = 0
 
     def get_g_loss(self, net, fakeB, realB):
         # First, G(A) should fake the discriminator
@@ -244,19 +247,17 @@ class DiscLossWGANGP(DiscLossLS):
         return -self.D_fake.mean()
 
     def calc_gradient_penalty(self, netD, real_data, fake_data):
-        alpha = torch.rand(1, 1)
+        alpha = torch.rand(1, 1, device=real_data.device)
         alpha = alpha.expand(real_data.size())
-        alpha = alpha.cuda(0)
 
         interpolates = alpha * real_data + ((1 - alpha) * fake_data)
 
-        interpolates = interpolates.cuda(0)
         interpolates = Variable(interpolates, requires_grad=True)
 
         disc_interpolates = netD.forward(interpolates)
 
         gradients = autograd.grad(outputs=disc_interpolates, inputs=interpolates,
-                                  grad_outputs=torch.ones(disc_interpolates.size()).cuda(0),
+                                  grad_outputs=torch.ones_like(disc_interpolates),
                                   create_graph=True, retain_graph=True, only_inputs=True)[0]
 
         gradient_penalty = ((gradients.norm(2, dim=1) - 1) ** 2).mean() * self.LAMBDA
@@ -271,14 +272,17 @@ class DiscLossWGANGP(DiscLossLS):
         self.D_real = self.D_real.mean()
         # Combined loss
         self.loss_D = self.D_fake - self.D_real
+        self.steps += 1
+        if (self.steps - 1) % self.gp_every:
+            return self.loss_D
         gradient_penalty = self.calc_gradient_penalty(net, realB.data, fakeB.data)
-        return self.loss_D + gradient_penalty
+        return self.loss_D + self.gp_every * gradient_penalty
 
 
-def get_loss(model):
+def get_loss(model, device='cuda'):
     if model['content_loss'] == 'perceptual':
         content_loss = PerceptualLoss()
-        content_loss.initialize(nn.MSELoss())
+        content_loss.initialize(nn.MSELoss(), device)
     elif model['content_loss'] == 'l1':
         content_loss = ContentLoss()
         content_loss.initialize(nn.L1Loss())
@@ -286,7 +290,7 @@ def get_loss(model):
         raise ValueError("ContentLoss [%s] not recognized." % model['content_loss'])
 
     if model['disc_loss'] == 'wgan-gp':
-        disc_loss = DiscLossWGANGP()
+        disc_loss = DiscLossWGANGP(gp_every=model.get('gp_every', 1))
     elif model['disc_loss'] == 'lsgan':
         disc_loss = DiscLossLS()
     elif model['disc_loss'] == 'gan':
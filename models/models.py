@@ -1,20 +1,20 @@
 import numpy as np
 import torch.nn as nn
-from skimage.measure import compare_ssim as SSIM
 
-from util.metrics import PSNR
+from util.metrics import PSNR, SSIM
 import torch
-torch.cuda.set_device(0)
+
 
 class DeblurModel(nn.Module):
-    def __init__(self):
+    def __init__(self, device='cuda'):
         super(DeblurModel, self).__init__()
+        self.device = torch.device(device)
 
     def get_input(self, data):
         img = data['a']
         inputs = img
         targets = data['b']
-        inputs, targets = inputs.cuda(0), targets.cuda(0)
+        inputs, targets = inputs.to(self.device), targets.to(self.device)
         return inputs, targets
 
     def tensor2im(self, image_tensor, imtype=np.uint8):
@@ -22,15 +22,21 @@ class DeblurModel(nn.Module):
         image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0
         return image_numpy.astype(imtype)
 
+    @staticmethod
+    def to_unit(x):
+        return ((x.float() + 1) / 2).clamp(0, 1)
+
     def get_images_and_metrics(self, inp, output, target) -> (float, float, np.ndarray):
         inp = self.tensor2im(inp)
         fake = self.tensor2im(output.data)
         real = self.tensor2im(target.data)
         psnr = PSNR(fake, real)
-        ssim = SSIM(fake, real, multichannel=True)
+        with torch.no_grad():
+            # gaussian window SSIM on the device, the same metric as test_metrics.py
+            ssim = SSIM(self.to_unit(output[:1]), self.to_unit(target[:1])).item()
         vis_img = np.hstack((inp, fake, real))
         return psnr, ssim, vis_img
 
 
-def get_model(model_config):
-    return DeblurModel()
+def get_model(model_config, device='cuda'):
+    return DeblurModel(device)
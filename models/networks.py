@@ -4,18 +4,19 @@ from torch.nn import init
 import functools
 from torch.autograd import Variable
 import numpy as np
-from .fpn_mobilenet import FPNMobileNet
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 
 #############################################
 
-from .fpn_ghostnet import FPNGhostNet, HINet
+# the generators are imported in get_generator and get_norm_layer, so that inference only loads
+# the selected one and its backbone library
 
 #############################################
 
 ###############################################################################
 # Functions
 ###############################################################################
-torch.cuda.set_device(0)
 
 def get_norm_layer(norm_type='instance', affine= False):
     if norm_type == 'batch':
@@ -23,6 +24,7 @@ def get_norm_layer(norm_type='instance', affine= False):
     elif norm_type == 'instance':
         norm_layer = functools.partial(nn.InstanceNorm2d, affine=affine, track_running_stats=True)
     elif norm_type=='hin':
+        from .fpn_ghostnet import HINet
         norm_layer= HINet
         
     else:
@@ -267,6 +269,26 @@ class NLayerDiscriminator(nn.Module):
         return self.model(input)
 
 
+# Patch and full discriminator of double_gan on a shared trunk.
+class DoubleDiscriminator(nn.Module):
+    """The first n_layers stride-2 blocks are identical in the patch discriminator (n_layers) and the
+    full one (full_layers), here they run once. The patch head and the remaining blocks of the full
+    discriminator branch off the shared features; forward returns (patch, full)."""
+    def __init__(self, input_nc=3, ndf=64, n_layers=3, full_layers=5, norm_layer=nn.BatchNorm2d):
+        super(DoubleDiscriminator, self).__init__()
+        patch = NLayerDiscriminator(input_nc, ndf, n_layers, norm_layer).model
+        full = NLayerDiscriminator(input_nc, ndf, full_layers, norm_layer).model
+        # the input conv and LeakyReLU, then conv, norm and LeakyReLU per further stride-2 block
+        shared = 2 + 3 * (n_layers - 1)
+        self.trunk = patch[:shared]
+        self.patch = patch[shared:]
+        self.full = full[shared:]
+
+    def forward(self, input):
+        x = self.trunk(input)
+        return self.patch(x), self.full(x)
+
+
 def get_fullD(model_config):
     model_d = NLayerDiscriminator(n_layers=5,
                                   norm_layer=get_norm_layer(norm_type=model_config['norm_layer']),
@@ -274,21 +296,108 @@ def get_fullD(model_config):
     return model_d
 
 
-def get_generator(model_config, cuda= True):
+def parallelize(model, cuda=True):
+    """Wraps a network for data parallel training: DistributedDataParallel when a process group
+    has been initialised (see util.distributed), DataParallel on the current device otherwise."""
+    # same check as util.distributed.is_distributed, which the inference package can not import
+    if dist.is_available() and dist.is_initialized():
+        if cuda:
+            device = torch.cuda.current_device()
+            return DistributedDataParallel(model.cuda(device), device_ids=[device])
+        return DistributedDataParallel(model)
+    if cuda:
+        device = torch.cuda.current_device()
+        return nn.DataParallel(model.cuda(device), device_ids=[device])
+    return model
+
+
+def unwrap(model):
+    return model.module if isinstance(model, (nn.DataParallel, DistributedDataParallel)) else model
+
+
+def set_inference_mode(model):
+    """Puts a generator into its deblurring configuration: BatchNorm layers (the backbone) use their
+    running statistics, instance norm layers normalise with the statistics of every image as in
+    training. No forward pass updates a buffer afterwards, so one model can serve several threads."""
+    model.eval()
+    for m in model.modules():
+        if isinstance(m, nn.modules.instancenorm._InstanceNorm) and m.track_running_stats:
+            # in eval mode these would switch to running statistics, which the generator never used
+            m.track_running_stats = False
+            m.running_mean = None
+            m.running_var = None
+    return model
+
+
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+@functools.lru_cache(maxsize=None)
+def cpu_bf16_supported():
+    """Whether this torch build has CPU bfloat16 kernels for the ops of the generator: plain and
+    depthwise convolutions, BatchNorm in eval mode, the ghostnet activations, nearest upsampling and
+    tanh. Older releases lack some of them and only fail at the first forward."""
+    probe = nn.Sequential(nn.Conv2d(3, 8, 3, padding=1), nn.BatchNorm2d(8), nn.ReLU(inplace=True),
+                          nn.Conv2d(8, 8, 3, padding=1, groups=8), nn.Hardsigmoid(), nn.ReLU6(),
+                          nn.AdaptiveAvgPool2d(2), nn.Upsample(scale_factor=2, mode='nearest'), nn.Tanh())
+    try:
+        with torch.no_grad():
+            x = probe.eval().to(torch.bfloat16)(torch.rand(1, 3, 8, 8, dtype=torch.bfloat16))
+            torch.cat([x, x], 1).clamp(-1, 1)
+    except RuntimeError:
+        return False
+    return True
+
+
+def set_precision(model, precision='fp32', channels_last=False):
+    """Converts a generator for inference in `precision` (see PRECISIONS) and optionally the
+    channels_last memory format. Instance norm layers, HINet's included, keep their fp32 parameters
+    and normalise in fp32, the statistics of a whole feature map are not stable in half precision."""
+    dtype = PRECISIONS[precision]
+    if dtype == torch.float16 and next(model.parameters()).device.type != 'cuda':
+        # many CPU kernels have no Half implementation, the first forward would fail
+        raise ValueError('fp16 needs a model on CUDA, use bf16 on CPU')
+    if dtype == torch.bfloat16 and next(model.parameters()).device.type == 'cpu' and not cpu_bf16_supported():
+        raise ValueError(f'torch {torch.__version__} has no CPU bf16 kernels for the generator, use fp32')
+    model.to(dtype=dtype, memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+    if dtype != torch.float32:
+        for m in model.modules():
+            if isinstance(m, nn.modules.instancenorm._InstanceNorm):
+                m.float()
+                m.register_forward_pre_hook(lambda m, inputs: tuple(x.float() for x in inputs))
+                m.register_forward_hook(lambda m, inputs, output, dtype=dtype: output.to(dtype))
+    return model
+
+
+def load_weights(model, weights_path, map_location=None):
+    """Loads a checkpoint written by train.py into a parallel-wrapped or a bare model. The saved keys
+    carry the 'module.' prefix of the wrapper."""
+    state_dict = torch.load(weights_path, map_location=map_location)['model']
+    if not isinstance(model, (nn.DataParallel, DistributedDataParallel)):
+        state_dict = {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model
+
+
+def get_generator(model_config, cuda= True, pretrained= True):
     generator_name = model_config['g_name']
     if generator_name == 'fpn_mobilenet':
-        model_g = FPNMobileNet(norm_layer=get_norm_layer(norm_type=model_config['norm_layer']))
+        from .fpn_mobilenet import FPNMobileNet
+        model_g = FPNMobileNet(norm_layer=get_norm_layer(norm_type=model_config['norm_layer']), pretrained=pretrained)
     
     elif generator_name == 'fpn_ghostnet_gm_hin':
-        model_g= FPNGhostNet(norm_layer=get_norm_layer(norm_type=model_config['norm_layer'], affine= True))
+        from .fpn_ghostnet import FPNGhostNet
+        model_g= FPNGhostNet(norm_layer=get_norm_layer(norm_type=model_config['norm_layer'], affine= True),
+                             pretrained=pretrained, checkpointing=model_config.get('checkpointing', False),
+                             fast_warmup=model_config.get('fast_warmup', False))
     
     else:
         raise ValueError("Generator Network [%s] not recognized." % generator_name)
 
-    return nn.DataParallel(model_g,device_ids = [0]) if cuda else model_g
+    return parallelize(model_g, cuda)
 
 
-def get_discriminator(model_config):
+def get_discriminator(model_config, cuda=True):
     discriminator_name = model_config['d_name']
     if discriminator_name == 'no_gan':
         model_d = None
@@ -296,24 +405,30 @@ def get_discriminator(model_config):
         model_d = NLayerDiscriminator(n_layers=model_config['d_layers'],
                                       norm_layer=get_norm_layer(norm_type=model_config['norm_layer']),
                                       use_sigmoid=False)
-        model_d = nn.DataParallel(model_d, device_ids= [0])
+        model_d = parallelize(model_d, cuda)
+    elif discriminator_name == 'double_gan' and model_config.get('shared_d_trunk', False):
+        model_d = DoubleDiscriminator(n_layers=model_config['d_layers'],
+                                      norm_layer=get_norm_layer(norm_type=model_config['norm_layer']))
+        model_d = parallelize(model_d, cuda)
     elif discriminator_name == 'double_gan':
         patch_gan = NLayerDiscriminator(n_layers=model_config['d_layers'],
                                         norm_layer=get_norm_layer(norm_type=model_config['norm_layer']),
                                         use_sigmoid=False)
-        patch_gan = nn.DataParallel(patch_gan, device_ids= [0])
+        patch_gan = parallelize(patch_gan, cuda)
         full_gan = get_fullD(model_config)
-        full_gan = nn.DataParallel(full_gan, device_ids= [0])
+        full_gan = parallelize(full_gan, cuda)
         model_d = {'patch': patch_gan,
                    'full': full_gan}
     elif discriminator_name == 'multi_scale':
         model_d = MultiScaleDiscriminator(norm_layer=get_norm_layer(norm_type=model_config['norm_layer']))
-        model_d = nn.DataParallel(model_d, device_ids= [0])
+        model_d = parallelize(model_d, cuda)
     else:
         raise ValueError("Discriminator Network [%s] not recognized." % discriminator_name)
 
     return model_d
 
 
-def get_nets(model_config):
-    return get_generator(model_config), get_discriminator(model_config)
+def get_nets(model_config, cuda=True):
+    # pretrained: False skips the ImageNet weights of the backbone, for tests and resumed runs
+    return (get_generator(model_config, cuda, pretrained=model_config.get('pretrained', True)),
+            get_discriminator(model_config, cuda))
@@ -1,30 +1,66 @@
+import multiprocessing as mp
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from typing import Optional
+from itertools import islice
+from typing import List, Optional
 
 import cv2
 import numpy as np
 import torch
-import yaml
-from fire import Fire
-from tqdm import tqdm
-import random 
-from .aug import get_normalize
-from .models.networks import get_generator
+
+# yaml, fire, tqdm and albumentations are not imported at module level: predict is the entry point
+# of processes that are restarted often and only need the model, see benchmark_startup.py
+from .models.networks import get_generator, load_weights, PRECISIONS, set_inference_mode, set_precision, unwrap
+from .util.metrics import PSNR
+from .util.timing import StageTimer
 
 
 class Predictor:
-    def __init__(self, weights_path: str, model_name: str = '', cuda: bool = True):
-        with open('./modules/GhostDeblurGAN/config/config.yaml') as cfg:
-            config = yaml.safe_load(cfg)
-        model = get_generator(model_name or config['model'], cuda= cuda)
-        model.load_state_dict(torch.load(weights_path)['model']) if weights_path is not None else None
-        self.model = model.module.cpu() if not cuda else model.cuda()
+    """Deblurs RGB uint8 images. Calls don't modify the model, one Predictor can be shared by
+    several threads.
+
+    train_mode=True restores the former behaviour of running the whole generator in training mode,
+    where the backbone BatchNorm layers normalise with the statistics of the current frame and
+    update their running statistics on every call; it is not thread safe.
+
+    `precision` is fp32, bf16 (CPUs with bf16 support) or fp16 (GPU), instance norm stays in fp32.
+    With `channels_last` the model and the inputs use the NHWC memory format, which speeds up the
+    depthwise convolutions of ghostnet, especially combined with bf16 on CPU.
+    """
+
+    def __init__(self, weights_path: str, model_name: str = '', cuda: bool = True, timing: bool = False,
+                 train_mode: bool = False, precision: str = 'fp32', channels_last: bool = False):
+        if not model_name:
+            import yaml
+            with open('./modules/GhostDeblurGAN/config/config.yaml') as cfg:
+                model_name = yaml.safe_load(cfg)['model']
+        # ImageNet weights of the backbone would be overwritten by the checkpoint, don't download them
+        model = get_generator(model_name, cuda=False, pretrained=weights_path is None)
+        if weights_path is not None:
+            load_weights(model, weights_path, map_location='cpu')
+        self.model = model.cuda() if cuda else model
         self.cuda= cuda
-        self.model.train(True)
-        # GAN inference should be in train mode to use actual stats in norm layers,
-        # it's not a bug
-        self.normalize_fn = get_normalize()
+        self.device = torch.device('cuda' if cuda else 'cpu')
+        set_precision(self.model, precision, channels_last)
+        self.dtype = PRECISIONS[precision]
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        if train_mode:
+            self.model.train(True)
+        else:
+            # instance norm keeps using the actual stats, BatchNorm is frozen
+            set_inference_mode(self.model)
+
+        # per stage wall times, also used by process_video and custom_main
+        self.timer = StageTimer(enabled=timing, cuda_sync=cuda)
+
+    @staticmethod
+    def _normalize(x: np.ndarray, bgr: bool = False) -> np.ndarray:
+        # aug.get_normalize (mean=std=0.5) without importing albumentations, the channel reversal
+        # of BGR inputs is a free view before the conversion
+        return (x[..., ::-1] if bgr else x).astype(np.float32) / 127.5 - 1
 
     @staticmethod
     def _array_to_batch(x):
@@ -32,9 +68,12 @@ class Predictor:
         x = np.expand_dims(x, 0)
         return torch.from_numpy(x)
 
-    def _preprocess(self, x: np.ndarray, mask: Optional[np.ndarray]):
-        x, _ = self.normalize_fn(x, x)
-        if mask is None:
+    def _preprocess(self, x: np.ndarray, mask: Optional[np.ndarray], bgr: bool = False, with_mask: bool = True):
+        """Normalised and padded NCHW image and mask; with_mask=False skips the mask, which is then None."""
+        x = self._normalize(x, bgr)
+        if not with_mask:
+            mask = None
+        elif mask is None:
             mask = np.ones_like(x, dtype=np.float32)
         else:
             mask = np.round(mask.astype('float32') / 255)
@@ -48,28 +87,165 @@ class Predictor:
                       'constant_values': 0,
                       'pad_width': ((0, min_height - h), (0, min_width - w), (0, 0))
                       }
-        x = np.pad(x, **pad_params)
-        mask = np.pad(mask, **pad_params)
+        x = self._array_to_batch(np.pad(x, **pad_params))
+        if mask is not None:
+            mask = self._array_to_batch(np.pad(mask, **pad_params))
 
-        return map(self._array_to_batch, (x, mask)), h, w
+        return (x, mask), h, w
+
+    def _to_device(self, x: torch.Tensor) -> torch.Tensor:
+        return x.to(self.device, dtype=self.dtype, memory_format=self.memory_format)
 
     @staticmethod
-    def _postprocess(x: torch.Tensor) -> np.ndarray:
-        x, = x
-        x = x.detach().cpu().float().numpy()
-        x = (np.transpose(x, (1, 2, 0)) + 1) / 2.0 * 255.0
-        return x.astype('uint8')
-
-    def __call__(self, img: np.ndarray, mask: Optional[np.ndarray], ignore_mask=True) -> np.ndarray:
-        (img, mask), h, w = self._preprocess(img, mask)
-        with torch.no_grad():
-            inputs = [img.cuda() if self.cuda else img.cpu()]
+    def _postprocess(x: torch.Tensor, h: int, w: int, bgr: bool = False) -> np.ndarray:
+        """NCHW output in [-1, 1] to contiguous uint8 NHWC, cropped to h x w. Scaling, crop, channel
+        order and the cast run on the model's device, only uint8 data is copied to the host."""
+        x = x[:, :, :h, :w]
+        if bgr:
+            x = x.flip(1)
+        x = ((x.float() + 1) * 127.5).clamp_(0, 255).to(torch.uint8)
+        return x.permute(0, 2, 3, 1).contiguous().cpu().numpy()
+
+    def __call__(self, img: np.ndarray, mask: Optional[np.ndarray], ignore_mask=True, bgr: bool = False) -> np.ndarray:
+        """Deblurs an RGB image, or a BGR one as read by OpenCV with bgr=True, and returns the result in
+        the same channel order."""
+        with self.timer.stage('preprocess'):
+            (img, mask), h, w = self._preprocess(img, mask, bgr, with_mask=not ignore_mask)
+        with self.timer.stage('forward'), torch.inference_mode():
+            inputs = [self._to_device(img)]
             if not ignore_mask:
                 inputs += [mask]
             pred = self.model(*inputs)
-        return self._postprocess(pred)[:h, :w, :]
+        with self.timer.stage('postprocess'):
+            return self._postprocess(pred, h, w, bgr)[0]
+
+    def predict_batch(self, imgs: List[np.ndarray], bgr: bool = False) -> List[np.ndarray]:
+        """Deblurs several images of the same size, e.g. consecutive video frames, in one forward pass."""
+        with self.timer.stage('preprocess'):
+            batch = []
+            for img in imgs:
+                (x, _), h, w = self._preprocess(img, None, bgr, with_mask=False)
+                batch.append(x)
+            batch = torch.cat(batch)
+        with self.timer.stage('forward'), torch.inference_mode():
+            pred = self.model(self._to_device(batch))
+        with self.timer.stage('postprocess'):
+            return list(self._postprocess(pred, h, w, bgr))
+
+
+    def predict_reuse(self, img: np.ndarray, coarse=None, bgr: bool = False):
+        """Deblurs `img` with FPNGhostNet.forward_reuse, returns the result and the coarse features
+        to pass back for the next frame."""
+        with self.timer.stage('preprocess'):
+            (x, _), h, w = self._preprocess(img, None, bgr, with_mask=False)
+        with self.timer.stage('forward'), torch.inference_mode():
+            pred, coarse = unwrap(self.model).forward_reuse(self._to_device(x), coarse)
+        with self.timer.stage('postprocess'):
+            return self._postprocess(pred, h, w, bgr)[0], coarse
+
+
+class CoarseFeatureReuse:
+    """Experimental video mode for static cameras: the coarse pyramid levels of a key frame are
+    reused for following frames as long as they differ from it by less than `threshold`, the mean
+    absolute difference in grey levels of frames downscaled by `diff_scale`. A new key frame is
+    taken at least every `max_reuse` frames.
+
+    With `compare=True` every reusing frame is also deblurred with full recomputation, and `report`
+    gives the PSNR of the reused result against it. `bgr` is the channel order of the frames.
+    """
+
+    def __init__(self, predictor: Predictor, threshold: float = 2., max_reuse: int = 30, diff_scale: int = 8,
+                 compare: bool = False, bgr: bool = False):
+        self.predictor = predictor
+        self.bgr = bgr
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.diff_scale = diff_scale
+        self.compare = compare
+        self.coarse = None
+        self.key_frame = None
+        self.reused = 0
+        self.frames = 0
+        self.reused_frames = 0
+        self.psnr = []
+
+    def _thumbnail(self, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        img = cv2.resize(img, (max(1, w // self.diff_scale), max(1, h // self.diff_scale)),
+                         interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY if self.bgr else cv2.COLOR_RGB2GRAY).astype('float32')
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        thumbnail = self._thumbnail(img)
+        reuse = (self.coarse is not None and self.reused < self.max_reuse and
+                 np.abs(thumbnail - self.key_frame).mean() < self.threshold)
+        self.frames += 1
+        if not reuse:
+            pred, self.coarse = self.predictor.predict_reuse(img, bgr=self.bgr)
+            self.key_frame = thumbnail
+            self.reused = 0
+            return pred
 
-def process_video(pairs, predictor, output_dir):
+        pred, _ = self.predictor.predict_reuse(img, self.coarse, bgr=self.bgr)
+        self.reused += 1
+        self.reused_frames += 1
+        if self.compare:
+            full, _ = self.predictor.predict_reuse(img, bgr=self.bgr)
+            self.psnr.append(PSNR(pred, full))
+        return pred
+
+    def report(self) -> dict:
+        report = {'frames': self.frames,
+                  'reused_frames': self.reused_frames,
+                  'reuse_ratio': self.reused_frames / max(1, self.frames)}
+        if self.psnr:
+            report.update(psnr_vs_full_mean=float(np.mean(self.psnr)), psnr_vs_full_min=float(np.min(self.psnr)))
+        return report
+
+
+class FrameBatcher:
+    """Accumulates frames and deblurs them `batch_size` at a time with `Predictor.predict_batch`.
+
+    `put` returns the deblurred frames that became ready, in input order. With `max_latency`
+    (seconds) a partial batch is run as soon as its oldest frame has waited that long, which bounds
+    the delay for live sources; without it only full batches run until `flush`. `bgr` is the channel
+    order of the frames.
+    """
+
+    def __init__(self, predictor: Predictor, batch_size: int, max_latency: Optional[float] = None,
+                 bgr: bool = False):
+        self.predictor = predictor
+        self.bgr = bgr
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.frames = []
+        self.oldest = None
+
+    def put(self, frame: np.ndarray) -> List[np.ndarray]:
+        if not self.frames:
+            self.oldest = time.monotonic()
+        self.frames.append(frame)
+        if len(self.frames) >= self.batch_size:
+            return self.flush()
+        return self.poll()
+
+    def poll(self) -> List[np.ndarray]:
+        """Runs the partial batch if it is over the latency cap, for callers without a steady frame rate."""
+        if self.frames and self.max_latency is not None and time.monotonic() - self.oldest >= self.max_latency:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[np.ndarray]:
+        if not self.frames:
+            return []
+        frames, self.frames = self.frames, []
+        return self.predictor.predict_batch(frames, bgr=self.bgr)
+
+
+def process_video(pairs, predictor, output_dir, batch_size: int = 1, max_latency: Optional[float] = None,
+                  reuse_threshold: Optional[float] = None, reuse_report: bool = False):
+    from tqdm import tqdm
+    timer = predictor.timer
     for video_filepath, mask in tqdm(pairs):
         video_filename = os.path.basename(video_filepath)
         output_filepath = os.path.join(output_dir, os.path.splitext(video_filename)[0]+'_deblur.mp4')
@@ -80,21 +256,216 @@ def process_video(pairs, predictor, output_dir):
         total_frame_num = int(video_in.get(cv2.CAP_PROP_FRAME_COUNT))
         video_out = cv2.VideoWriter(output_filepath, cv2.VideoWriter_fourcc(*'MP4V'), fps, (width, height))
         tqdm.write(f'process {video_filepath} to {output_filepath}, {fps}fps, resolution: {width}x{height}')
+        # all frames of a video share the resolution, so consecutive frames can be batched;
+        # frames stay BGR, the predictor reorders the channels on the device
+        batcher = FrameBatcher(predictor, batch_size, max_latency, bgr=True)
+        reuse = None
+        if reuse_threshold is not None:
+            reuse = CoarseFeatureReuse(predictor, threshold=reuse_threshold, compare=reuse_report, bgr=True)
+
+        def write(preds):
+            for pred in preds:
+                with timer.stage('write'):
+                    video_out.write(pred)
+
         for frame_num in tqdm(range(total_frame_num), desc=video_filename):
-            res, img = video_in.read()
+            with timer.stage('read'):
+                res, img = video_in.read()
             if not res:
                 break
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            pred = predictor(img, mask)
-            pred = cv2.cvtColor(pred, cv2.COLOR_RGB2BGR)
-            video_out.write(pred)
+            with timer.stage('predict'):
+                preds = batcher.put(img) if reuse is None else [reuse(img)]
+            write(preds)
+        with timer.stage('predict'):
+            preds = batcher.flush()
+        write(preds)
+        video_out.release()
+        if reuse is not None:
+            tqdm.write(f'coarse feature reuse: {reuse.report()}')
+
+# output extensions and the cv2.imwrite flag of their compression setting
+IMAGE_FORMATS = {'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+                 'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+                 'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+                 'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY)}
+
+
+def imwrite_params(path: str, compression: Optional[int] = None) -> List[int]:
+    """cv2.imwrite parameters for `path`: `compression` is the zlib level (0-9) for png and the
+    quality (0-100) for jpg and webp. None keeps the OpenCV defaults."""
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if compression is None or ext not in IMAGE_FORMATS:
+        return []
+    return [IMAGE_FORMATS[ext][1], int(compression)]
+
+
+def read_image(f_img: str, f_mask: Optional[str] = None):
+    # BGR as stored, see Predictor.__call__(bgr=True)
+    img = cv2.imread(f_img)
+    mask = cv2.imread(f_mask) if f_mask is not None else None
+    return img, mask
+
+
+def write_image(path: str, img: np.ndarray, pred: np.ndarray, side_by_side: bool = False, params=()):
+    if side_by_side:
+        pred = np.hstack((img, pred))
+    cv2.imwrite(path, pred, list(params))
+    return path
+
+
+def process_folder(jobs, predictor: Predictor, side_by_side: bool = False, compression: Optional[int] = None,
+                   io_workers: int = 4, prefetch: int = 8):
+    """Deblurs (image, mask, output path) jobs. Decoding and encoding run on `io_workers` threads
+    (cv2 releases the GIL): up to `prefetch` images are read ahead of the model and written behind
+    it, so disk I/O and png encoding overlap with inference. io_workers=0 does everything inline.
+
+    The 'read' and 'write' stages of the timer are the time inference waits for them.
+    """
+    from tqdm import tqdm
+    timer = predictor.timer
+    if io_workers <= 0:
+        for f_img, f_mask, out_path in tqdm(jobs):
+            with timer.stage('read'):
+                img, mask = read_image(f_img, f_mask)
+            with timer.stage('predict'):
+                pred = predictor(img, mask, bgr=True)
+            with timer.stage('write'):
+                write_image(out_path, img, pred, side_by_side, imwrite_params(out_path, compression))
+        return
+
+    with ThreadPoolExecutor(io_workers) as executor:
+        reads = (executor.submit(read_image, f_img, f_mask) for f_img, f_mask, _ in jobs)
+        pending_reads = deque(islice(reads, prefetch))
+        pending_writes = deque()
+        for _, _, out_path in tqdm(jobs):
+            with timer.stage('read'):
+                img, mask = pending_reads.popleft().result()
+            pending_reads.extend(islice(reads, 1))
+            with timer.stage('predict'):
+                pred = predictor(img, mask, bgr=True)
+            pending_writes.append(executor.submit(write_image, out_path, img, pred, side_by_side,
+                                                  imwrite_params(out_path, compression)))
+            if len(pending_writes) > prefetch:
+                with timer.stage('write'):
+                    pending_writes.popleft().result()
+        with timer.stage('write'):
+            for write in pending_writes:
+                write.result()
+
+
+# per process state of InferencePool workers
+_worker_predictor = None
+
+
+def _init_worker(weights_path: str, threads: int, cores, predictor_kwargs):
+    global _worker_predictor
+    torch.set_num_threads(threads)
+    # the pool already runs one process per core group, cv2 doesn't need threads of its own
+    cv2.setNumThreads(1)
+    if cores is not None:
+        os.sched_setaffinity(0, cores.get())
+    _worker_predictor = Predictor(weights_path=weights_path, cuda=False, **predictor_kwargs)
+
+
+def _deblur_file(job):
+    f_img, f_mask, out_path, side_by_side, params = job
+    img, mask = read_image(f_img, f_mask)
+    write_image(out_path, img, _worker_predictor(img, mask, bgr=True), side_by_side, params)
+    return out_path
+
+
+def _deblur_frames(frames):
+    return [_worker_predictor(frame, None, bgr=True) for frame in frames]
+
+
+class InferencePool:
+    """CPU worker processes with a Predictor each, for folder and video jobs on many-core machines.
+
+    Intra-op parallelism scales poorly on the small 1x1 and depthwise convolutions of the generator,
+    several workers with few threads each use the cores better. By default the cores are split
+    evenly, `threads_per_worker` overrides that; with `pin_cores` every worker is bound to its own
+    cores. Jobs are spread over the workers and `imap` yields the results in input order, with at
+    most `max_in_flight` jobs queued so that inputs are not read ahead of the workers.
+    """
+
+    def __init__(self, weights_path: str, workers: int, threads_per_worker: Optional[int] = None,
+                 pin_cores: bool = False, max_in_flight: Optional[int] = None, **predictor_kwargs):
+        available = sorted(os.sched_getaffinity(0))
+        threads = threads_per_worker or max(1, len(available) // workers)
+        ctx = mp.get_context('spawn')
+        cores = None
+        if pin_cores:
+            cores = ctx.Queue()
+            for i in range(workers):
+                cores.put(available[i * threads:(i + 1) * threads] or available)
+        self.workers = workers
+        self.threads_per_worker = threads
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.pool = ctx.Pool(workers, initializer=_init_worker, initargs=(weights_path, threads, cores, predictor_kwargs))
+
+    def imap(self, fn, jobs):
+        pending = deque()
+        for job in jobs:
+            if len(pending) >= self.max_in_flight:
+                yield pending.popleft().get()
+            pending.append(self.pool.apply_async(fn, (job,)))
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def process_video_pool(pairs, pool: InferencePool, output_dir, segment_frames: int = 8):
+    """process_video on an InferencePool: segments of `segment_frames` consecutive frames are
+    deblurred by different workers and written back in order."""
+    from tqdm import tqdm
+    for video_filepath, mask in tqdm(pairs):
+        video_filename = os.path.basename(video_filepath)
+        output_filepath = os.path.join(output_dir, os.path.splitext(video_filename)[0]+'_deblur.mp4')
+        video_in = cv2.VideoCapture(video_filepath)
+        fps = video_in.get(cv2.CAP_PROP_FPS)
+        width = int(video_in.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video_in.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        total_frame_num = int(video_in.get(cv2.CAP_PROP_FRAME_COUNT))
+        video_out = cv2.VideoWriter(output_filepath, cv2.VideoWriter_fourcc(*'MP4V'), fps, (width, height))
+        tqdm.write(f'process {video_filepath} to {output_filepath}, {fps}fps, resolution: {width}x{height}, '
+                   f'{pool.workers} workers x {pool.threads_per_worker} threads')
+
+        def segments():
+            while True:
+                frames = []
+                while len(frames) < segment_frames:
+                    res, img = video_in.read()
+                    if not res:
+                        break
+                    frames.append(img)
+                if frames:
+                    yield frames
+                if len(frames) < segment_frames:
+                    return
+
+        with tqdm(total=total_frame_num, desc=video_filename) as progress:
+            for preds in pool.imap(_deblur_frames, segments()):
+                for pred in preds:
+                    video_out.write(pred)
+                progress.update(len(preds))
+        video_out.release()
+
 
 def main(img_pattern: str,
          mask_pattern: Optional[str] = None,
          weights_path='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5',
          out_dir='submit',
          side_by_side: bool = False,
-         video: bool = True, cuda: bool= True):
+         video: bool = True, cuda: bool= True, timing: bool = False,
+         batch_size: int = 1, max_latency: Optional[float] = None,
+         reuse_threshold: Optional[float] = None, reuse_report: bool = False,
+         workers: int = 0, threads_per_worker: Optional[int] = None, pin_cores: bool = False,
+         segment_frames: int = 8, io_workers: int = 4, out_format: Optional[str] = None,
+         compression: Optional[int] = None, precision: str = 'fp32', channels_last: bool = False):
+    from tqdm import tqdm
     def sorted_glob(pattern):
         return sorted(glob(pattern))
 
@@ -102,35 +473,49 @@ def main(img_pattern: str,
     masks = sorted_glob(mask_pattern) if mask_pattern is not None else [None for _ in imgs]
     pairs = zip(imgs, masks)
     names = sorted([os.path.basename(x) for x in glob(img_pattern)])
-    predictor = Predictor(weights_path=weights_path, cuda= cuda)
-
+    if out_format is not None:
+        names = [os.path.splitext(name)[0] + IMAGE_FORMATS[out_format][0] for name in names]
     os.makedirs(out_dir, exist_ok=True)
+    if workers > 0:
+        # CPU process pool, see InferencePool
+        pool = InferencePool(weights_path, workers, threads_per_worker, pin_cores,
+                             precision=precision, channels_last=channels_last)
+        try:
+            if not video:
+                jobs = [(f_img, f_mask, os.path.join(out_dir, name), side_by_side,
+                         imwrite_params(name, compression)) for name, (f_img, f_mask) in zip(names, pairs)]
+                for _ in tqdm(pool.imap(_deblur_file, jobs), total=len(jobs)):
+                    pass
+            else:
+                process_video_pool(pairs, pool, out_dir, segment_frames)
+        finally:
+            pool.close()
+        return
+
+    predictor = Predictor(weights_path=weights_path, cuda= cuda, timing=timing, precision=precision,
+                          channels_last=channels_last)
+    timer = predictor.timer
+
     if not video:
-        for name, pair in tqdm(zip(names, pairs), total=len(names)):
-            f_img, f_mask = pair
-            img, mask = map(cv2.imread, (f_img, f_mask))
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-            pred = predictor(img, mask)
-            if side_by_side:
-                pred = np.hstack((img, pred))
-            pred = cv2.cvtColor(pred, cv2.COLOR_RGB2BGR)
-            cv2.imwrite(os.path.join(out_dir, name),
-                        pred)
+        jobs = [(f_img, f_mask, os.path.join(out_dir, name)) for name, (f_img, f_mask) in zip(names, pairs)]
+        process_folder(jobs, predictor, side_by_side, compression, io_workers)
     else:
-        process_video(pairs, predictor, out_dir)
+        process_video(pairs, predictor, out_dir, batch_size=batch_size, max_latency=max_latency,
+                      reuse_threshold=reuse_threshold, reuse_report=reuse_report)
+    if timing:
+        print(timer.message())
+        timer.to_json(os.path.join(out_dir, 'timings.json'))
 
-def init_predictor(weights_path='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5', cuda: bool= True):
-    predictor = Predictor(weights_path=weights_path, cuda= cuda)
+def init_predictor(weights_path='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5', cuda: bool= True,
+                   timing: bool = False, precision: str = 'fp32', channels_last: bool = False):
+    predictor = Predictor(weights_path=weights_path, cuda= cuda, timing=timing, precision=precision,
+                          channels_last=channels_last)
     return predictor
 
 def custom_main(img,predictor):
-    img_pred = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    pred = predictor(img_pred, None)
-    pred = cv2.cvtColor(pred, cv2.COLOR_RGB2BGR)
-    # result = np.hstack((img, pred))
-    # cv2.imwrite(f"./test{random.randint(0,100)}.jpg",result)
-    return pred
+    # BGR in and out, the channel reordering happens on the predictor's device
+    return predictor(img, None, bgr=True)
 
 if __name__ == '__main__':
-    Fire(custom_main)
+    from fire import Fire
+    Fire(main)
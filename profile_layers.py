@@ -0,0 +1,55 @@
+import argparse
+import json
+
+import torch
+
+from models.networks import get_generator, set_inference_mode
+from util.layer_profiler import LayerProfiler
+
+NORM_LAYERS = {'fpn_ghostnet_gm_hin': 'hin',
+               'fpn_mobilenet': 'instance'}
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser('Per layer time, memory and MACs of a generator')
+    parser.add_argument('--model', default='fpn_ghostnet_gm_hin', choices=list(NORM_LAYERS))
+    parser.add_argument('--resolution', default='736x1312', help='Input size as HxW, or a single number for square inputs')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', choices=('cpu', 'cuda'))
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads(), help='CPU threads')
+    parser.add_argument('--warmup', type=int, default=3, help='Unprofiled iterations before measuring')
+    parser.add_argument('--iters', type=int, default=5, help='Profiled iterations, the table shows their mean')
+    parser.add_argument('--top', type=int, default=30, help='Rows of the layer table')
+    parser.add_argument('--trace', default='profile_layers_trace.json', help='Chrome trace of the profiled iterations')
+    parser.add_argument('--output', default='profile_layers.json', help='Json file for the layer and type tables')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    # weights don't affect the timings, the generator is built without downloading them
+    model = get_generator({'g_name': args.model, 'norm_layer': NORM_LAYERS[args.model]},
+                          cuda=False, pretrained=False).to(device)
+    # same mode as Predictor
+    set_inference_mode(model)
+    h, _, w = args.resolution.partition('x')
+    x = torch.randn(args.batch_size, 3, int(h), int(w or h), device=device)
+
+    with torch.inference_mode():
+        for _ in range(args.warmup):
+            model(x)
+        profiler = LayerProfiler(model, cuda_sync=device.type == 'cuda')
+        with profiler:
+            for _ in range(args.iters):
+                model(x)
+
+    print(profiler.table(args.top))
+    profiler.save_trace(args.trace)
+    with open(args.output, 'w') as f:
+        json.dump({'args': vars(args), 'layers': profiler.layers(), 'types': profiler.types()}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
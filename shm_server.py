@@ -0,0 +1,20 @@
+from fire import Fire
+
+from .util.shared_frames import SOCKET_DIR, SharedMemoryWorker
+
+
+def main(weights_path='./modules/GhostDeblurGAN/trained_weights/fpn_ghostnet_gm_hin.h5',
+         socket_dir: str = SOCKET_DIR,
+         max_batch_size: int = 8,
+         cuda: bool = True):
+    from .predict import Predictor
+    worker = SharedMemoryWorker(Predictor(weights_path=weights_path, cuda=cuda), socket_dir, max_batch_size)
+    print(f'waiting for frames on {worker.address}')
+    try:
+        worker.serve()
+    finally:
+        worker.close()
+
+
+if __name__ == '__main__':
+    Fire(main)
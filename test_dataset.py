@@ -1,5 +1,6 @@
 import os
 import unittest
+from itertools import islice
 from shutil import rmtree
 from tempfile import mkdtemp
 
@@ -7,7 +8,7 @@ import cv2
 import numpy as np
 from torch.utils.data import DataLoader
 
-from dataset import PairedDataset
+from dataset import InfiniteSampler, PairedDataset, get_dataloader
 
 
 def make_img():
@@ -74,3 +75,35 @@ class AugTest(unittest.TestCase):
             a, b = map(lambda x: x.numpy(), map(batch.get, ('a', 'b')))
 
             assert not np.all(a == b), 'images should not be the same'
+
+    def test_seeded_dataloader(self):
+        config = {'files_a': os.path.join(self.raw, '*.png'),
+                  'files_b': os.path.join(self.gt, '*.png'),
+                  'size': 32,
+                  'scope': 'strong',
+                  'crop': 'random',
+                  'preload': 0,
+                  'preload_size': 0,
+                  'corrupt': [{'name': 'cutout', 'prob': 0.5},
+                              {'name': 'jpeg'}],
+                  'verbose': False}
+        batches = []
+        for _ in range(2):
+            dataset = PairedDataset.from_config(config)
+            dataloader = get_dataloader(dataset, batch_size=2, num_workers=2, seed=0)
+            batch = next(iter(dataloader))
+            batches.append(np.concatenate([batch['a'].numpy(), batch['b'].numpy()]))
+
+        np.testing.assert_allclose(*batches)
+
+    def test_infinite_sampler(self):
+        shards = [list(islice(InfiniteSampler(range(10), seed=0, rank=rank, world_size=2), 10)) for rank in (0, 1)]
+        # two passes over the dataset, every pass covers it exactly once across the ranks
+        for epoch in range(2):
+            indices = sum((shard[epoch * 5:(epoch + 1) * 5] for shard in shards), [])
+            self.assertEqual(sorted(indices), list(range(10)))
+
+    def test_unseeded_sampler(self):
+        # without a configured seed every run shuffles differently
+        self.assertNotEqual(InfiniteSampler(range(10)).seed, InfiniteSampler(range(10)).seed)
+        self.assertEqual(InfiniteSampler(range(10), seed=3).seed, 3)
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+import unittest
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+
+from deblur_server import DynamicBatcher, make_handler
+
+
+class FakePredictor:
+    # stands in for the Predictor: inverts the frames and records the batch sizes
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+
+    def predict_batch(self, imgs, bgr=False):
+        self.batches.append(len(imgs))
+        if self.error is not None:
+            raise self.error
+        return [255 - img for img in imgs]
+
+
+def call_all(batcher, imgs):
+    results = [None] * len(imgs)
+
+    def call(i):
+        try:
+            results[i] = batcher(imgs[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(imgs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    return results
+
+
+def frame(h=8, w=8):
+    return (np.random.rand(h, w, 3) * 255).astype('uint8')
+
+
+class DynamicBatcherTest(unittest.TestCase):
+    def test_full_batches(self):
+        predictor = FakePredictor()
+        # a long max_wait, so batches only run when they are full
+        batcher = DynamicBatcher(predictor, max_batch_size=4, max_wait=30)
+        imgs = [frame() for _ in range(8)]
+        start = time.monotonic()
+        results = call_all(batcher, imgs)
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(predictor.batches, [4, 4])
+        for img, result in zip(imgs, results):
+            np.testing.assert_array_equal(result, 255 - img)
+        self.assertEqual(batcher.stats.summary()['frames'], 8)
+
+    def test_max_wait(self):
+        predictor = FakePredictor()
+        batcher = DynamicBatcher(predictor, max_batch_size=8, max_wait=0.1)
+        start = time.monotonic()
+        result, = call_all(batcher, [frame()])
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(predictor.batches, [1])
+        self.assertEqual(result.shape, (8, 8, 3))
+
+    def test_resolutions_are_not_mixed(self):
+        predictor = FakePredictor()
+        batcher = DynamicBatcher(predictor, max_batch_size=2, max_wait=30)
+        results = call_all(batcher, [frame(8, 8), frame(8, 16), frame(8, 8), frame(8, 16)])
+
+        self.assertEqual(predictor.batches, [2, 2])
+        self.assertEqual([r.shape[1] for r in results], [8, 16, 8, 16])
+
+    def test_full_group_does_not_wait(self):
+        predictor = FakePredictor()
+        batcher = DynamicBatcher(predictor, max_batch_size=2, max_wait=1)
+        # an older frame of another resolution, alone in its group until max_wait
+        single = threading.Thread(target=call_all, args=(batcher, [frame(8, 8)]))
+        single.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        results = call_all(batcher, [frame(8, 16), frame(8, 16)])
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual([r.shape for r in results], [(8, 16, 3)] * 2)
+        single.join(timeout=10)
+        self.assertEqual(predictor.batches, [2, 1])
+
+    def test_errors_reach_every_request(self):
+        predictor = FakePredictor(error=RuntimeError('out of memory'))
+        batcher = DynamicBatcher(predictor, max_batch_size=3, max_wait=30)
+        results = call_all(batcher, [frame() for _ in range(3)])
+
+        self.assertEqual(predictor.batches, [3])
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(batcher.stats.summary()['errors'], 3)
+
+
+class DeblurHandlerTest(unittest.TestCase):
+    def request(self, predictor, path, body):
+        batcher = DynamicBatcher(predictor, max_batch_size=1, max_wait=0)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(batcher))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+            connection.request('POST', path, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_raw(self):
+        img = frame(4, 6)
+        status, body = self.request(FakePredictor(), '/deblur?format=raw&width=6&height=4', img.tobytes())
+        self.assertEqual(status, 200)
+        np.testing.assert_array_equal(np.frombuffer(body, dtype=np.uint8).reshape(4, 6, 3), 255 - img)
+
+    def test_bad_request(self):
+        for query in ('width=6', 'width=6&height=x', 'width=6&height=5'):
+            status, body = self.request(FakePredictor(), '/deblur?format=raw&' + query, frame(4, 6).tobytes())
+            self.assertEqual(status, 400, query)
+            self.assertIn('error', json.loads(body))
+
+    def test_failed_batch(self):
+        status, body = self.request(FakePredictor(error=RuntimeError('out of memory')),
+                                    '/deblur?format=raw&width=6&height=4', frame(4, 6).tobytes())
+        self.assertEqual(status, 500)
+        self.assertIn('out of memory', json.loads(body)['error'])
@@ -0,0 +1,125 @@
+import os
+import socket
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.utils.data.distributed import DistributedSampler
+
+from dataset import get_dataloader
+from metric_counter import MetricCounter
+from models.networks import NLayerDiscriminator, parallelize, unwrap
+from train import Trainer
+from util.distributed import cleanup, get_rank, get_world_size, init_distributed, is_main_process
+
+WORLD_SIZE = 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def join(rank, port):
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port),
+                      RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(WORLD_SIZE))
+    return init_distributed('gloo')
+
+
+def train_step(rank, port, out_dir):
+    device = join(rank, port)
+    # every rank starts from different weights, DDP has to broadcast the ones of rank 0
+    torch.manual_seed(rank)
+    net = parallelize(NLayerDiscriminator(n_layers=2, norm_layer=nn.InstanceNorm2d), cuda=False)
+    optimizer = torch.optim.SGD(net.parameters(), lr=0.1)
+    net(torch.rand(2, 3, 32, 32, device=device)).mean().backward()
+    optimizer.step()
+
+    sampler = DistributedSampler(range(10), shuffle=True)
+    torch.save({'params': torch.cat([p.detach().flatten() for p in unwrap(net).parameters()]),
+                'indices': list(sampler),
+                'world_size': get_world_size(),
+                'is_main': is_main_process()}, os.path.join(out_dir, f'{rank}.pt'))
+    cleanup()
+
+
+TRAINER_CONFIG = {'warmup_num': 3, 'num_epochs': 10,
+                  'model': {'g_name': 'fpn_ghostnet_gm_hin', 'd_name': 'double_gan', 'd_layers': 3,
+                            'content_loss': 'l1', 'adv_lambda': 0.001, 'disc_loss': 'ragan-ls',
+                            'norm_layer': 'hin', 'pretrained': False},
+                  'optimizer': {'name': 'adam', 'lr': 0.0001},
+                  'scheduler': {'name': 'linear', 'start_epoch': 5, 'min_lr': 0.0000001}}
+
+
+def trainer_run(rank, port, out_dir):
+    join(rank, port)
+    loader = get_dataloader(list(range(12)), batch_size=2, num_workers=0, seed=0,
+                            rank=get_rank(), world_size=get_world_size())
+    epochs = []
+    for epoch in range(2):
+        loader.sampler.set_epoch(epoch)
+        epochs.append([i for batch in loader for i in batch.tolist()])
+
+    counter = MetricCounter(os.path.join(out_dir, f'metrics{rank}'), write=is_main_process())
+    for value in ((1., 2.), (3., 4., 5.))[rank]:
+        counter.add_metrics(value, 0.5)
+    counter.synchronize()
+    counter.write_to_tensorboard(0, validation=True)
+    counter.close()
+
+    # every rank starts from different weights and trains on different data
+    torch.manual_seed(rank)
+    trainer = Trainer(dict(TRAINER_CONFIG, experiment_desc=os.path.join(out_dir, f'train{rank}')),
+                      train=None, val=None, device=torch.device('cpu'))
+    trainer._init_params()
+    trainer.netG.train()
+    shape = (1, 3, 64, 64)
+    trainer._train_step({'a': torch.rand(shape) * 2 - 1, 'b': torch.rand(shape) * 2 - 1})
+    trainer.metric_counter.close()
+    torch.save({'epochs': epochs,
+                'psnr': (len(counter.metrics['PSNR']), counter.metrics['PSNR'].total_mean()),
+                'best': counter.update_best_model(),
+                'params': torch.cat([p.detach().flatten() for p in unwrap(trainer.netG).parameters()])},
+               os.path.join(out_dir, f'{rank}.pt'))
+    cleanup()
+
+
+class DistributedTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_gloo_cpu_processes(self):
+        mp.spawn(train_step, args=(free_port(), self.tmp_dir), nprocs=WORLD_SIZE)
+        results = [torch.load(os.path.join(self.tmp_dir, f'{rank}.pt')) for rank in range(WORLD_SIZE)]
+
+        torch.testing.assert_allclose(results[0]['params'], results[1]['params'])
+        self.assertEqual([r['world_size'] for r in results], [WORLD_SIZE] * WORLD_SIZE)
+        self.assertEqual([r['is_main'] for r in results], [True, False])
+        indices = results[0]['indices'] + results[1]['indices']
+        self.assertEqual(sorted(indices), list(range(10)))
+
+    def test_gloo_trainer(self):
+        mp.spawn(trainer_run, args=(free_port(), self.tmp_dir), nprocs=WORLD_SIZE)
+        results = [torch.load(os.path.join(self.tmp_dir, f'{rank}.pt')) for rank in range(WORLD_SIZE)]
+
+        # the sampler shards the dataset without overlap and reshuffles after set_epoch
+        for epoch in range(2):
+            indices = results[0]['epochs'][epoch] + results[1]['epochs'][epoch]
+            self.assertEqual(sorted(indices), list(range(12)))
+        self.assertNotEqual(results[0]['epochs'][0], results[0]['epochs'][1])
+        # the merged validation metrics, the same on every rank
+        self.assertEqual([r['psnr'] for r in results], [(5, 3.)] * WORLD_SIZE)
+        self.assertEqual([r['best'] for r in results], [True] * WORLD_SIZE)
+        # only rank 0 writes tensorboard events and logs
+        self.assertTrue(os.path.isdir(os.path.join(self.tmp_dir, 'metrics0')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'metrics1')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, 'train1')))
+        # DDP broadcasts the weights of rank 0 and averages the gradients
+        torch.testing.assert_allclose(results[0]['params'], results[1]['params'])
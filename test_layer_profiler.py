@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from util.layer_profiler import LayerProfiler
+
+
+class Concat(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = nn.Conv2d(3, 8, kernel_size=3, padding=1)
+        self.norm = nn.BatchNorm2d(8)
+
+    def forward(self, x):
+        y = self.norm(self.conv(x))
+        return torch.cat([y, y], dim=1)[:, :12]
+
+
+class LayerProfilerTest(unittest.TestCase):
+    def test_layers(self):
+        model = nn.Sequential(Concat(), nn.ReLU()).eval()
+        x = torch.rand(1, 3, 16, 16)
+        with torch.no_grad(), LayerProfiler(model, cuda_sync=False) as profiler:
+            for _ in range(3):
+                model(x)
+
+        layers = {row['name']: row for row in profiler.layers()}
+        self.assertEqual(set(layers), {'Sequential', '0', '0.conv', '0.norm', '1'})
+        self.assertEqual(layers['0.conv']['calls'], 1)
+        self.assertAlmostEqual(layers['0.conv']['gmacs'], 16 * 16 * 8 * 3 * 9 / 1e9)
+        self.assertEqual(layers['0']['gmacs'], 0)
+        self.assertAlmostEqual(layers['0']['output_mb'], 12 * 16 * 16 * 4 / 2 ** 20)
+        self.assertLessEqual(layers['0']['self_ms'], layers['0']['total_ms'])
+        types = {row['type']: row for row in profiler.types()}
+        self.assertEqual(types['Conv2d']['modules'], 1)
+        self.assertIn('Concat', profiler.table())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            profiler.save_trace(path)
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)['traceEvents']), 3 * 5)
+
+    def test_hooks_removed(self):
+        model = nn.Sequential(nn.Conv2d(3, 3, 1))
+        with LayerProfiler(model, cuda_sync=False) as profiler:
+            pass
+        model(torch.rand(1, 3, 4, 4))
+        self.assertEqual(profiler.layers(), [])
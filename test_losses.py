@@ -0,0 +1,116 @@
+import random
+import tempfile
+import unittest
+from contextlib import nullcontext
+
+import torch
+
+from adversarial_trainer import DoubleGAN, _SharedForward
+from benchmark_train_step import legacy_update_d
+from models.losses import DiscLossWGANGP, RelativisticDiscLossLS
+from models.networks import DoubleDiscriminator, NLayerDiscriminator
+from train import Trainer
+
+
+class WGANGPTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.net = NLayerDiscriminator(n_layers=2)
+        self.fake = torch.rand(2, 3, 32, 32)
+        self.real = torch.rand(2, 3, 32, 32)
+
+    def test_lazy_gradient_penalty(self):
+        criterion = DiscLossWGANGP(gp_every=2)
+        losses = []
+        for _ in range(4):
+            loss = criterion(self.net, self.fake, self.real)
+            losses.append((loss - criterion.loss_D).item())
+
+        # the penalty is applied on steps 1 and 3 only, with twice the weight
+        self.assertGreater(losses[0], 0)
+        self.assertEqual(losses[1], 0)
+        self.assertGreater(losses[2], 0)
+        self.assertEqual(losses[3], 0)
+
+    def test_penalty_weight(self):
+        penalties = []
+        for gp_every in (1, 4):
+            torch.manual_seed(1)
+            criterion = DiscLossWGANGP(gp_every=gp_every)
+            penalties.append(criterion(self.net, self.fake, self.real) - criterion.loss_D)
+
+        eager, lazy = penalties
+        torch.testing.assert_allclose(lazy, 4 * eager)
+
+
+class SharedTrunkTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.fused = DoubleDiscriminator(n_layers=3)
+        self.patch = NLayerDiscriminator(n_layers=3)
+        self.full = NLayerDiscriminator(n_layers=5)
+        # the trunk followed by a head has the layers of the separate discriminator
+        for net, head in ((self.patch, self.fused.patch), (self.full, self.fused.full)):
+            params = list(self.fused.trunk.parameters()) + list(head.parameters())
+            for p, q in zip(net.parameters(), params):
+                p.data.copy_(q.data)
+        self.fake = torch.rand(2, 3, 64, 64, requires_grad=True)
+        self.real = torch.rand(2, 3, 64, 64)
+
+    def test_same_losses(self):
+        separate = DoubleGAN({'patch': self.patch, 'full': self.full}, RelativisticDiscLossLS())
+        fused = DoubleGAN(self.fused, RelativisticDiscLossLS())
+        torch.testing.assert_allclose(fused.loss_d(self.fake, self.real), separate.loss_d(self.fake, self.real))
+        torch.testing.assert_allclose(fused.loss_g(self.fake, self.real), separate.loss_g(self.fake, self.real))
+        self.assertEqual(len(fused.get_params()), len(list(self.fused.parameters())))
+
+    def test_one_trunk_pass(self):
+        calls = []
+        self.fused.trunk.register_forward_hook(lambda *_: calls.append(1))
+        DoubleGAN(self.fused, RelativisticDiscLossLS()).loss_d(self.fake, self.real)
+        # a fake and a real batch, shared by both criteria
+        self.assertEqual(len(calls), 2)
+
+    def test_input_changed_in_place(self):
+        calls = []
+        self.fused.trunk.register_forward_hook(lambda *_: calls.append(1))
+        shared = _SharedForward(self.fused)
+        before = shared(self.real, 0)
+        self.assertIs(shared(self.real.detach(), 0), before)
+        self.real.mul_(0.5)
+        after = shared(self.real, 0)
+
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(torch.equal(before, after))
+
+
+class TrainStepTest(unittest.TestCase):
+    """The generator update with frozen discriminators and the D update without retain_graph give the
+    losses of the former step, see benchmark_train_step.py."""
+    config = {'experiment_desc': None, 'warmup_num': 3, 'num_epochs': 10,
+              'model': {'g_name': 'fpn_ghostnet_gm_hin', 'd_name': 'double_gan', 'd_layers': 3,
+                        'content_loss': 'l1', 'adv_lambda': 0.001, 'disc_loss': 'ragan-ls',
+                        'norm_layer': 'hin', 'pretrained': False},
+              'optimizer': {'name': 'adam', 'lr': 0.0001},
+              'scheduler': {'name': 'linear', 'start_epoch': 5, 'min_lr': 0.0000001}}
+
+    def losses(self, legacy):
+        random.seed(0)
+        torch.manual_seed(0)
+        config = dict(self.config, experiment_desc=tempfile.mkdtemp())
+        trainer = Trainer(config, train=None, val=None, device=torch.device('cpu'))
+        trainer._init_params()
+        trainer.netG.train()
+        if legacy:
+            trainer._update_d = legacy_update_d(trainer)
+            trainer._frozen_d = nullcontext
+        shape = (1, 3, 64, 64)
+        for _ in range(2):
+            trainer._train_step({'a': torch.rand(shape) * 2 - 1, 'b': torch.rand(shape) * 2 - 1})
+        trainer.metric_counter.close()
+        metrics = trainer.metric_counter.metrics
+        return [metrics[name].values() for name in ('G_loss', 'D_loss')]
+
+    def test_same_losses(self):
+        for former, current in zip(self.losses(legacy=True), self.losses(legacy=False)):
+            torch.testing.assert_allclose(torch.from_numpy(current), torch.from_numpy(former), rtol=1e-5, atol=1e-6)
@@ -0,0 +1,68 @@
+import unittest
+
+import numpy as np
+
+from metric_counter import BackgroundWriter, MetricCounter, RunningMetric
+
+
+class RunningMetricTest(unittest.TestCase):
+    def test_aggregates(self):
+        values = np.random.RandomState(0).randn(250) * 3 + 10
+        metric = RunningMetric(window=100)
+        for i, value in enumerate(values, 1):
+            metric.add(value)
+            self.assertAlmostEqual(metric.window_mean(), values[max(0, i - 100):i].mean())
+
+        self.assertEqual(len(metric), 250)
+        self.assertAlmostEqual(metric.total_mean(), values.mean())
+        self.assertAlmostEqual(metric.std, values.std())
+        np.testing.assert_allclose(metric.values(), values[-100:])
+
+    def test_merge(self):
+        values = np.random.RandomState(0).randn(180) * 3 + 10
+        for split in (0, 30, 150):
+            metric, other = RunningMetric(window=100), RunningMetric(window=100)
+            for value in values[:split]:
+                metric.add(value)
+            for value in values[split:]:
+                other.add(value)
+            metric.merge(other)
+            metric.add(1.)
+            expected = np.append(values, 1.)
+
+            self.assertEqual(len(metric), 181)
+            self.assertAlmostEqual(metric.total_mean(), expected.mean())
+            self.assertAlmostEqual(metric.std, expected.std())
+            self.assertAlmostEqual(metric.window_mean(), expected[-100:].mean())
+            np.testing.assert_allclose(metric.values(), expected[-100:])
+
+    def test_empty(self):
+        metric = RunningMetric()
+        self.assertTrue(np.isnan(metric.window_mean()))
+        self.assertEqual(len(metric.values()), 0)
+
+
+class MetricCounterTest(unittest.TestCase):
+    def test_losses(self):
+        counter = MetricCounter('test', write=False)
+        for i in range(10):
+            counter.add_losses(float(i), 1.)
+            counter.add_metrics(20. + i, 0.5)
+        counter.add_d_loss(2.)
+
+        self.assertEqual(len(counter.metrics['G_loss']), 10)
+        self.assertEqual(len(counter.metrics['D_loss']), 11)
+        self.assertAlmostEqual(counter.metrics['G_loss_adv'].total_mean(), 3.5)
+        self.assertEqual(counter.loss_message(), 'G_loss=4.5000; PSNR=24.5000; SSIM=0.5000')
+        self.assertTrue(counter.update_best_model())
+        self.assertFalse(counter.update_best_model())
+
+    def test_background_writer(self):
+        written = []
+        writer = BackgroundWriter()
+        for i in range(5):
+            writer.submit(written.append, i)
+        writer.flush()
+        self.assertEqual(written, list(range(5)))
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
@@ -5,25 +5,34 @@ import torch
 import cv2
 import yaml
 import os
-from torchvision import models, transforms
-from torch.autograd import Variable
+import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import shutil
 import glob
 import tqdm
-from util.metrics import PSNR
-from albumentations import Compose, CenterCrop, PadIfNeeded
+from util.metrics import PSNR, PSNR_batch, SSIM as gaussian_SSIM
+from albumentations import PadIfNeeded
+from joblib import cpu_count
 from PIL import Image
 from ssim.ssimlib import SSIM 
-from models.networks import get_generator
+from models.networks import get_generator, load_weights, set_inference_mode
 from functools import partial
 
-torch.cuda.set_device(0)
+METRICS = ('gaussian', 'cw-ssim')
+
 
 def get_args():
 	parser = argparse.ArgumentParser('Test an image')
 	parser.add_argument('--img_folder', required=True, help='GoPRO Folder')
 	parser.add_argument('--weights_path', required=True, help='Weights path')
 	parser.add_argument("--new_gopro",  action= "store_true", help= "whether to use new go pro dir structure or old go pro dir structure, by default assumes old go pro dir structure, specifying this option will revert")
+	parser.add_argument('--batch_size', type=int, default=4, help='Images per generator forward pass')
+	parser.add_argument('--io_workers', type=int, default=4, help='Threads reading blurred and sharp images')
+	parser.add_argument('--metric_workers', type=int, default=cpu_count(), help='Processes computing cw-ssim')
+	parser.add_argument('--metric', default='gaussian', choices=METRICS,
+						help='gaussian: gaussian window SSIM on the generator device, cw-ssim: complex wavelet SSIM of pyssim, much slower')
 
 	return parser.parse_args()
 
@@ -43,83 +52,121 @@ def get_gt_image(path, new_gopro= False):
 	return img
 
 
-def test_image(model, image_path, new_gopro= False):
-	img_transforms = transforms.Compose([
-		transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-	])
-	size_transform = Compose([
-		PadIfNeeded(736, 1280)
-	])
-	crop = CenterCrop(720, 1280)
-	img = cv2.imread(image_path)
-	img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-	img_s = size_transform(image=img)['image']
-	img_tensor = torch.from_numpy(np.transpose(img_s / 255, (2, 0, 1)).astype('float32'))
-	img_tensor = img_transforms(img_tensor)
-	with torch.no_grad():
-		img_tensor = Variable(img_tensor.unsqueeze(0).cuda())
-		result_image = model(img_tensor)
-	result_image = result_image[0].cpu().float().numpy()
-	result_image = (np.transpose(result_image, (1, 2, 0)) + 1) / 2.0 * 255.0
-	result_image = crop(image=result_image)['image']
-	result_image = result_image.astype('uint8')
-	gt_image = get_gt_image(image_path, new_gopro)
-	_, filename = os.path.split(image_path)
+def read_pair(image_path, new_gopro= False):
+	"""Reads a blurred image padded to 736x1280, and its sharp counterpart."""
+	size_transform = PadIfNeeded(736, 1280)
+	img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+	return size_transform(image=img)['image'], img.shape[:2], get_gt_image(image_path, new_gopro)
+
+
+def read_imgs(images, new_gopro= False, executor= None, prefetch= 8):
+	"""Yields the pairs of `images` in order, reading up to `prefetch` of them ahead with `executor`."""
+	read = partial(read_pair, new_gopro=new_gopro)
+	if executor is None:
+		yield from map(read, images)
+		return
+	pending = deque()
+	for image in images:
+		pending.append(executor.submit(read, image))
+		if len(pending) > prefetch:
+			yield pending.popleft().result()
+	while pending:
+		yield pending.popleft().result()
+
+
+def crop_padded(img, shape):
+	# inverse of PadIfNeeded, which centers the image in the padded canvas; works on HWC and NHWC
+	h, w = shape
+	top, left = (img.shape[-3] - h) // 2, (img.shape[-2] - w) // 2
+	return img[..., top:top + h, left:left + w, :]
+
+
+def compute_metrics(result_image, gt_image):
 	psnr = PSNR(result_image, gt_image)
-	pilFake = Image.fromarray(result_image)
-	pilReal = Image.fromarray(gt_image)
-	ssim = SSIM(pilFake).cw_ssim_value(pilReal)
+	ssim = SSIM(Image.fromarray(result_image)).cw_ssim_value(Image.fromarray(gt_image))
 	return psnr, ssim
 
-def read_imgs(images):
-	
-	
-	images_= []
-	for img_ in images:
-		img = cv2.imread(img_)
-		img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-		img_s = size_transform(image=img)['image']
-		img_tensor = torch.from_numpy(np.transpose(img_s / 255, (2, 0, 1)).astype('float32'))
-		img_tensor = img_transforms(img_tensor)
-		images_.append(img_tensor)
-	images_= np.array(images_)
-	images_= torch.from_numpy(images)
-	
+
+def compute_batch_metrics(results, gt_images):
+	"""PSNR and gaussian window SSIM of a NHWC uint8 batch on its device against the sharp images."""
+	gt = torch.from_numpy(np.stack(gt_images))
+	psnr = PSNR_batch(results.cpu().numpy(), gt.numpy())
+	fake = results.permute(0, 3, 1, 2).float() / 255
+	real = gt.to(results.device).permute(0, 3, 1, 2).float() / 255
+	ssim = gaussian_SSIM(fake, real, size_average=False)
+	return psnr.tolist(), ssim.tolist()
+
+
+def test_image_batch(model, images, device):
+	"""Deblurs a list of padded uint8 RGB images of the same size in one forward pass.
+	Normalization and the conversion back to uint8 run on `device`, the NHWC uint8 result stays there."""
+	batch = torch.from_numpy(np.stack(images)).to(device)
+	batch = batch.permute(0, 3, 1, 2).float() / 127.5 - 1
 	with torch.no_grad():
-		
-		images_= Variable(images.cuda())
-	return images_
-	
-def test_image_batch(model, images, new_gopro= False):
-	img_transforms = transforms.Compose([
-		transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-	])
-	size_transform = Compose([
-		PadIfNeeded(736, 1280)
-	])
-	images_= read_imgs(images)
-	results_= model(images_)
-	results_= results_.cpu().float().numpy()
-	results_= (np.transpose(results_, (0, 2, 3, 1)) + 1) / 2.0 * 255.0
-	crop = CenterCrop(720, 1280)
-	results_= crop(image=results_)['image']
-	results_= results.astype('uint8')
-	get_gt_img= partial(get_gt_img, new_gopro=new_gopro)
-	get_gt_img_v= np.vectorize(get_gt_img)
-	gt_images= get_gt_img_v(results_)
-	
-	
+		results = model(batch)
+	results = ((results + 1) / 2.0 * 255.0).to(torch.uint8)
+	return results.permute(0, 2, 3, 1)
+
+
+def evaluate(model, files, new_gopro= False, batch_size= 4, io_workers= 4, metric_workers= cpu_count(), device= None,
+			 metric= 'gaussian'):
+	"""Evaluates `model` on `files`: images are read by a thread pool and deblurred in batches.
+	The gaussian metric is computed on the generator device, cw-ssim by a process pool while
+	the next batch runs through the generator."""
+	assert metric in METRICS, metric
+	device = device or next(model.parameters()).device
+	psnr, ssim = [], []
+	start = time.perf_counter()
+	with ExitStack() as stack:
+		readers = stack.enter_context(ThreadPoolExecutor(io_workers))
+		# the gaussian metric runs vectorised on the device, only cw-ssim needs worker processes
+		scorers = stack.enter_context(ProcessPoolExecutor(metric_workers)) if metric == 'cw-ssim' else None
+		scores = deque()
+
+		def collect(limit):
+			while len(scores) > limit:
+				cur_psnr, cur_ssim = scores.popleft().result()
+				psnr.append(cur_psnr)
+				ssim.append(cur_ssim)
+
+		def run(batch):
+			results = crop_padded(test_image_batch(model, [img for img, _, _ in batch], device), batch[0][1])
+			gt_images = [gt_image for _, _, gt_image in batch]
+			if metric == 'gaussian':
+				cur_psnr, cur_ssim = compute_batch_metrics(results, gt_images)
+				psnr.extend(cur_psnr)
+				ssim.extend(cur_ssim)
+				return
+			for result_image, gt_image in zip(results.cpu().numpy(), gt_images):
+				scores.append(scorers.submit(compute_metrics, result_image, gt_image))
+			# bounds the number of images held in memory when metrics are slower than the generator
+			collect(4 * metric_workers)
+
+		batch = []
+		for pair in tqdm.tqdm(read_imgs(files, new_gopro, readers, prefetch=2 * batch_size), total=len(files)):
+			# a batch shares the original size, so its padding and crop are the same as well
+			if batch and (len(batch) == batch_size or pair[1] != batch[0][1]):
+				run(batch)
+				batch = []
+			batch.append(pair)
+		if batch:
+			run(batch)
+		collect(0)
+	elapsed = time.perf_counter() - start
+	return {'metric': metric,
+			'images': len(psnr),
+			'PSNR': float(np.mean(psnr)),
+			'SSIM': float(np.mean(ssim)),
+			'seconds': elapsed,
+			'images_per_sec': len(psnr) / elapsed}
+
 
-def test(model, files, new_gopro= False):
-	psnr = 0
-	ssim = 0
-	for file in tqdm.tqdm(files):
-		cur_psnr, cur_ssim = test_image(model, file, new_gopro)
-		psnr += cur_psnr
-		ssim += cur_ssim
-	print("PSNR = {}".format(psnr / len(files)))
-	print("SSIM = {}".format(ssim / len(files)))
-	return psnr,ssim
+def test(model, files, new_gopro= False, **kwargs):
+	report = evaluate(model, files, new_gopro, **kwargs)
+	print("PSNR = {}".format(report['PSNR']))
+	print("SSIM ({}) = {}".format(report['metric'], report['SSIM']))
+	print("{:.2f} images/sec".format(report['images_per_sec']))
+	return report['PSNR'], report['SSIM']
 
 
 if __name__ == '__main__':
@@ -127,9 +174,12 @@ if __name__ == '__main__':
 	print(args)
 	with open('config/config.yaml') as cfg:
 		config = yaml.load(cfg)
-	model = get_generator(config['model'])
-	model.load_state_dict(torch.load(args.weights_path, map_location="cuda:0")['model'])
-	model = model.cuda()
+	device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+	model = get_generator(config['model'], cuda= device.type == 'cuda')
+	model = load_weights(model, args.weights_path, map_location=device).to(device)
+	# frozen BatchNorm statistics: the scores don't depend on the batch size or on which images share a batch
+	set_inference_mode(model)
 	filenames = sorted(glob.glob(args.img_folder  + '/**/*.png' if os.path.isdir(args.img_folder) else args.img_folder, recursive=True)) if args.new_gopro else sorted(glob.glob(args.img_folder  + '/**/blur/*.png' if os.path.isdir(args.img_folder) else args.img_folder, recursive=True))
 
-	_,__=test(model, filenames, args.new_gopro)
+	_,__=test(model, filenames, args.new_gopro, batch_size=args.batch_size, io_workers=args.io_workers,
+			  metric_workers=args.metric_workers, device=device, metric=args.metric)
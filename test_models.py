@@ -0,0 +1,151 @@
+import unittest
+
+import torch
+import torch.nn as nn
+
+from models.fpn_ghostnet import frozen_running_stats
+from models.networks import cpu_bf16_supported, get_generator, set_inference_mode, set_precision
+
+
+class FPNGhostNetTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = get_generator({'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin'}, cuda=False,
+                                   pretrained=False).eval()
+        self.x = torch.rand(2, 3, 64, 96) * 2 - 1
+
+    def test_forward_reuse(self):
+        with torch.no_grad():
+            expected = self.model(self.x)
+            output, coarse = self.model.forward_reuse(self.x)
+            reused, _ = self.model.forward_reuse(self.x, coarse)
+
+        torch.testing.assert_allclose(output, expected)
+        torch.testing.assert_allclose(reused, expected)
+
+
+class InferenceModeTest(unittest.TestCase):
+    def test_no_state_updates(self):
+        torch.manual_seed(0)
+        for config in ({'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin'},
+                       {'g_name': 'fpn_mobilenet', 'norm_layer': 'instance'}):
+            model = set_inference_mode(get_generator(config, cuda=False, pretrained=False))
+            state = {k: v.clone() for k, v in model.state_dict().items()}
+            x = torch.rand(4, 3, 64, 96) * 2 - 1
+            with torch.inference_mode():
+                batch = model(x)
+                singles = [model(x[i:i + 1]) for i in range(len(x))]
+
+            for k, v in model.state_dict().items():
+                torch.testing.assert_allclose(v, state[k])
+            # frozen BatchNorm and per image instance norm, the frames of a batch don't interact, so
+            # batched evaluation (test_metrics.py --batch_size) scores like one image at a time
+            for i, single in enumerate(singles):
+                torch.testing.assert_allclose(batch[i:i + 1], single)
+
+
+class PrecisionTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.config = {'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin'}
+        self.model = set_inference_mode(get_generator(self.config, cuda=False, pretrained=False))
+        self.x = torch.rand(1, 3, 64, 96) * 2 - 1
+
+    def test_channels_last(self):
+        other = set_inference_mode(get_generator(self.config, cuda=False, pretrained=False))
+        other.load_state_dict(self.model.state_dict())
+        set_precision(other, 'fp32', channels_last=True)
+        with torch.inference_mode():
+            expected = self.model(self.x)
+            output = other(self.x.contiguous(memory_format=torch.channels_last))
+
+        torch.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-4)
+
+    @unittest.skipUnless(cpu_bf16_supported(), 'no CPU bf16 kernels in this torch build')
+    def test_instance_norm_stays_fp32(self):
+        set_precision(self.model, 'bf16')
+        dtypes = {name: p.dtype for name, p in self.model.named_parameters()}
+
+        self.assertTrue(all(dtype == torch.float32 for name, dtype in dtypes.items() if 'instance_norm' in name))
+        self.assertEqual(self.model.fpn.enc0[0].weight.dtype, torch.bfloat16)
+
+    @unittest.skipUnless(cpu_bf16_supported(), 'no CPU bf16 kernels in this torch build')
+    def test_bf16_forward(self):
+        with torch.inference_mode():
+            expected = self.model(self.x)
+            set_precision(self.model, 'bf16')
+            output = self.model(self.x.to(torch.bfloat16))
+
+        self.assertEqual(output.dtype, torch.bfloat16)
+        # bf16 keeps 8 bits of mantissa, the error accumulates over the layers; outputs are in [-1, 1]
+        self.assertLess((output.float() - expected).abs().mean().item(), 0.02)
+
+    def test_fp16_needs_cuda(self):
+        with self.assertRaises(ValueError):
+            set_precision(self.model, 'fp16')
+
+    @unittest.skipIf(cpu_bf16_supported(), 'this torch build runs bf16 on CPU')
+    def test_bf16_rejected_without_kernels(self):
+        with self.assertRaises(ValueError):
+            set_precision(self.model, 'bf16')
+
+
+class CheckpointingTest(unittest.TestCase):
+    def test_same_gradients(self):
+        torch.manual_seed(0)
+        config = {'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin'}
+        models = [get_generator(config, cuda=False, pretrained=False) for _ in range(2)]
+        models[1].load_state_dict(models[0].state_dict())
+        models[1].set_checkpointing(True)
+        x = torch.rand(2, 3, 64, 96) * 2 - 1
+        for model in models:
+            model.train()
+            model.unfreeze()
+            model(x).abs().mean().backward()
+
+        reference, checkpointed = models
+        for (name, p), q in zip(reference.named_parameters(), checkpointed.parameters()):
+            if p.grad is None:
+                self.assertIsNone(q.grad, name)
+            else:
+                torch.testing.assert_allclose(q.grad, p.grad, msg=name)
+        # BatchNorm statistics are updated once per step, not again by the recomputation
+        for (name, v), w in zip(reference.state_dict().items(), checkpointed.state_dict().values()):
+            if name.endswith('num_batches_tracked'):
+                self.assertEqual(w.item(), v.item(), name)
+            else:
+                torch.testing.assert_allclose(w, v, msg=name)
+
+    def test_frozen_running_stats(self):
+        # momentum=None is a cumulative average, zeroing the momentum would not freeze it
+        bn = nn.BatchNorm2d(4, momentum=None).train()
+        bn(torch.rand(2, 4, 8, 8))
+        state = {k: v.clone() for k, v in bn.state_dict().items()}
+        with frozen_running_stats(bn):
+            bn(torch.rand(2, 4, 8, 8) + 1)
+        for name, value in bn.state_dict().items():
+            self.assertTrue(torch.equal(value, state[name]), name)
+
+
+class FastWarmupTest(unittest.TestCase):
+    def test_frozen_encoder(self):
+        torch.manual_seed(0)
+        # no train() call: the trainer builds the model and trains it in its default mode
+        model = get_generator({'g_name': 'fpn_ghostnet_gm_hin', 'norm_layer': 'hin', 'fast_warmup': True},
+                              cuda=False, pretrained=False)
+        self.assertTrue(model.training)
+        self.assertFalse(model.fpn.features.training)
+        x = torch.rand(2, 3, 64, 96) * 2 - 1
+        state = {k: v.clone() for k, v in model.fpn.features.state_dict().items()}
+
+        enc0, enc1, enc2 = model.fpn.encode_fine(x)
+        model(x).mean().backward()
+        self.assertFalse(model.fpn.features.training)
+        self.assertFalse(enc2.requires_grad)
+        for k, v in model.fpn.features.state_dict().items():
+            torch.testing.assert_allclose(v, state[k])
+        self.assertIsNotNone(model.fpn.lateral0.weight.grad)
+
+        model.unfreeze()
+        self.assertTrue(model.fpn.features.training)
+        self.assertTrue(model.fpn.encode_fine(x)[2].requires_grad)
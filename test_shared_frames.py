@@ -0,0 +1,113 @@
+import os
+import socket
+import threading
+import unittest
+from multiprocessing.shared_memory import SharedMemory
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as np
+
+from util.shared_frames import MESSAGE, WORKER_SOCKET, FrameRing, SharedFrameClient, SharedMemoryWorker
+
+
+class SharedFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = mkdtemp()
+        self.worker = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.worker.bind(os.path.join(self.socket_dir, WORKER_SOCKET))
+        self.clients = []
+
+    def tearDown(self):
+        # segments of failed tests are unlinked here, not left to the resource tracker
+        for client in self.clients:
+            client.close()
+        self.worker.close()
+        rmtree(self.socket_dir)
+
+    def client(self, name, *args, **kwargs):
+        client = SharedFrameClient(f'{name}_{os.getpid()}', *args, socket_dir=self.socket_dir, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def invert(self, n):
+        # stands in for the Predictor worker: writes 255 - input into the output slot
+        ring = None
+        while n:
+            message, address = self.worker.recvfrom(MESSAGE.size)
+            slot, = MESSAGE.unpack(message)
+            if slot < 0:
+                # ATTACH / DETACH
+                continue
+            n -= 1
+            ring = ring or FrameRing(os.path.splitext(os.path.basename(address))[0])
+            np.subtract(255, ring.inputs[slot], out=ring.outputs[slot])
+            self.worker.sendto(message, address)
+        ring.close()
+
+    def test_round_trip(self):
+        client = self.client('test', 16, 24, num_slots=2)
+        worker = threading.Thread(target=self.invert, args=(3,))
+        worker.start()
+        frames = [(np.random.rand(16, 24, 3) * 255).astype('uint8') for _ in range(3)]
+
+        slots = []
+        for frame in frames[:2]:
+            slot, view = client.acquire()
+            view[:] = frame
+            client.submit(slot)
+            slots.append(slot)
+        # views into shared memory have to be gone before the segment is closed
+        del view
+        with self.assertRaises(RuntimeError):
+            client.acquire()
+        for slot, frame in zip(slots, frames):
+            np.testing.assert_array_equal(client.wait(slot, timeout=5), 255 - frame)
+            client.release(slot)
+        np.testing.assert_array_equal(client(frames[2], timeout=5), 255 - frames[2])
+
+        worker.join()
+        client.close()
+
+    def test_stale_segment(self):
+        # a segment of the same name left behind by a crashed owner
+        stale = SharedMemory(name=f'stale_{os.getpid()}', create=True, size=16)
+        stale.close()
+        client = self.client('stale', 16, 24)
+        self.assertEqual((client.ring.height, client.ring.width), (16, 24))
+
+
+class InvertingPredictor:
+    def predict_batch(self, imgs, bgr=False):
+        return [255 - img for img in imgs]
+
+
+class SharedMemoryWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = mkdtemp()
+        self.worker = SharedMemoryWorker(InvertingPredictor(), self.socket_dir)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.worker.close()
+        rmtree(self.socket_dir)
+
+    def round_trip(self, client, frame):
+        slot, view = client.acquire()
+        view[:] = frame
+        del view
+        client.submit(slot)
+        self.worker.step()
+        np.testing.assert_array_equal(client.wait(slot, timeout=5), 255 - frame)
+        client.release(slot)
+
+    def test_client_restart(self):
+        name = f'restart_{os.getpid()}'
+        for h, w in ((16, 24), (16, 24), (8, 12)):
+            # same name, a new segment every time, the last one with another frame size
+            client = SharedFrameClient(name, h, w, num_slots=2, socket_dir=self.socket_dir)
+            self.clients.append(client)
+            self.round_trip(client, (np.random.rand(h, w, 3) * 255).astype('uint8'))
+            client.close()
@@ -0,0 +1,50 @@
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from util.metrics import SSIM, create_window, get_window
+
+
+def reference_ssim(img1, img2, window_size=11):
+    channel = img1.size(1)
+    window = create_window(window_size, channel).type_as(img1)
+    conv = lambda x: F.conv2d(x, window, padding=window_size // 2, groups=channel)
+    mu1, mu2 = conv(img1), conv(img2)
+    sigma1_sq = conv(img1 * img1) - mu1 ** 2
+    sigma2_sq = conv(img2 * img2) - mu2 ** 2
+    sigma12 = conv(img1 * img2) - mu1 * mu2
+    C1, C2 = 0.01 ** 2, 0.03 ** 2
+    return ((2 * mu1 * mu2 + C1) * (2 * sigma12 + C2)) / ((mu1 ** 2 + mu2 ** 2 + C1) * (sigma1_sq + sigma2_sq + C2))
+
+
+class SSIMTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.img1 = torch.rand(3, 3, 48, 64)
+        self.img2 = (self.img1 + 0.1 * torch.randn_like(self.img1)).clamp(0, 1)
+
+    def test_matches_reference(self):
+        expected = reference_ssim(self.img1, self.img2)
+        torch.testing.assert_allclose(SSIM(self.img1, self.img2), expected.mean())
+        torch.testing.assert_allclose(SSIM(self.img1, self.img2, size_average=False), expected.flatten(1).mean(1))
+
+    def test_per_image(self):
+        per_image = SSIM(self.img1, self.img2, size_average=False)
+        self.assertEqual(per_image.shape, (3,))
+        for i in range(3):
+            torch.testing.assert_allclose(per_image[i], SSIM(self.img1[i:i + 1], self.img2[i:i + 1]))
+        torch.testing.assert_allclose(SSIM(self.img1, self.img1, size_average=False), torch.ones(3))
+
+    def test_window_cache(self):
+        window = get_window(11, 3, torch.device('cpu'), torch.float32)
+        self.assertIs(window, get_window(11, 3, torch.device('cpu'), torch.float32))
+        torch.testing.assert_allclose(window, create_window(11, 3))
+
+    def test_window_cached_in_inference_mode(self):
+        get_window.cache_clear()
+        with torch.inference_mode():
+            SSIM(self.img1, self.img2)
+        img = self.img1.clone().requires_grad_()
+        SSIM(img, self.img2).backward()
+        self.assertIsNotNone(img.grad)
@@ -0,0 +1,26 @@
+import time
+import unittest
+
+from util.timing import StageTimer
+
+
+class StageTimerTest(unittest.TestCase):
+    def test_stages(self):
+        timer = StageTimer()
+        for _ in range(3):
+            with timer.stage('sleep'):
+                time.sleep(0.01)
+        data = list(timer.iterate(range(5), 'data'))
+
+        self.assertEqual(data, list(range(5)))
+        summary = timer.summary()
+        self.assertEqual(summary['sleep']['count'], 3)
+        self.assertEqual(summary['data']['count'], 5)
+        self.assertGreaterEqual(summary['sleep']['p50_ms'], 10)
+
+    def test_disabled(self):
+        timer = StageTimer(enabled=False)
+        with timer.stage('sleep'):
+            pass
+        self.assertEqual(list(timer.iterate(range(3))), [0, 1, 2])
+        self.assertEqual(timer.summary(), {})
@@ -1,100 +1,209 @@
-import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
 from functools import partial
 
 import cv2
+import numpy as np
 import torch
 import torch.optim as optim
 import tqdm
 import yaml
-from joblib import cpu_count
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
 
 from adversarial_trainer import GANFactory
-from dataset import PairedDataset
+from dataset import PairedDataset, get_dataloader
 from metric_counter import MetricCounter
 from models.losses import get_loss
 from models.models import get_model
-from models.networks import get_nets
+from models.networks import get_nets, parallelize, unwrap
 from schedulers import LinearDecay, WarmRestart
+from util.distributed import broadcast, cleanup, get_rank, get_world_size, init_distributed, is_distributed, \
+    is_main_process
+from util.timing import StageTimer
 
 cv2.setNumThreads(0)
-torch.cuda.set_device(0)
 
 class Trainer:
-    def __init__(self, config, train: DataLoader, val: DataLoader, continue_= False):
+    def __init__(self, config, train: DataLoader, val: DataLoader, continue_= False, device=torch.device('cuda')):
         self.config = config
         self.train_dataset = train
         self.val_dataset = val
         self.continue_= False
+        self.device = device
+        self.is_main = is_main_process()
         self.adv_lambda = config['model']['adv_lambda']
-        self.metric_counter = MetricCounter(config['experiment_desc'])
+        self.metric_counter = MetricCounter(config['experiment_desc'], write=self.is_main)
         self.warmup_epochs = config['warmup_num']
+        self.schedule = config.get('schedule', {})
+        self.step_mode = self.schedule.get('mode', 'epoch') == 'step'
+        timing = config.get('timing', {})
+        self.timer = StageTimer(enabled=timing.get('enabled', False), cuda_sync=timing.get('cuda_sync', False))
+        # every batch updates D, G is updated on every d_updates_per_g-th batch
+        self.d_updates_per_g = config['model'].get('d_updates_per_g', 1)
+        self.steps_done = 0
 
     def train(self):
         self._init_params()
-        for epoch in range(0, config['num_epochs']):
+        self.netG.train()
+        if self.step_mode:
+            return self._train_steps()
+        for epoch in range(0, self.config['num_epochs']):
             if (epoch == self.warmup_epochs) and not (self.warmup_epochs == 0):
-                self.netG.module.unfreeze()
-                self.optimizer_G = self._get_optim(self.netG.parameters())
-                self.scheduler_G = self._get_scheduler(self.optimizer_G)
+                self._unfreeze()
+            for loader in (self.train_dataset, self.val_dataset):
+                if isinstance(loader.sampler, DistributedSampler):
+                    loader.sampler.set_epoch(epoch)
             self._run_epoch(epoch)
             self._validate(epoch)
             self.scheduler_G.step()
             self.scheduler_D.step()
 
-            if self.metric_counter.update_best_model():
-                torch.save({
-                    'model': self.netG.state_dict()
-                }, 'best_{}.h5'.format(self.config['experiment_desc']))
+            if self.is_main:
+                self._save_checkpoints()
+                print(self.metric_counter.loss_message())
+                self.metric_counter.log("Experiment Name: %s, Epoch: %d, Loss: %s" % (
+                    self.config['experiment_desc'], epoch, self.metric_counter.loss_message()))
+
+    def _train_steps(self):
+        """Trains for schedule.num_steps batches drawn from an infinite sampler. Validation and
+        checkpointing happen every schedule.val_every_steps steps and/or schedule.val_every_minutes
+        minutes, schedulers are stepped after every batch."""
+        num_steps = self.schedule['num_steps']
+        warmup_steps = self.schedule.get('warmup_steps', 0)
+        val_every_steps = self.schedule.get('val_every_steps')
+        val_every_seconds = (self.schedule.get('val_every_minutes') or 0) * 60
+        data_iter = iter(self.train_dataset)
+        last_validation = time.monotonic()
+
+        self.metric_counter.clear()
+        tq = tqdm.tqdm(range(num_steps), disable=not self.is_main)
+        for step in tq:
+            if step == warmup_steps and warmup_steps:
+                self._unfreeze()
+            with self.timer.stage('data'):
+                data = next(data_iter)
+            img_for_vis = self._train_step(data)
+            self.scheduler_G.step()
+            self.scheduler_D.step()
+            tq.set_postfix(loss=self.metric_counter.loss_message())
+
+            done = step + 1
+            validate = done == num_steps or bool(val_every_steps and done % val_every_steps == 0)
+            if val_every_seconds:
+                # every rank has to take the same decision, DDP forwards inside _validate are collective
+                validate = broadcast(validate or time.monotonic() - last_validation > val_every_seconds)
+            if not validate:
+                continue
+            self.metric_counter.add_image(img_for_vis, tag='train')
+            self.metric_counter.write_to_tensorboard(done)
+            self._write_timings(done)
+            self._validate(done, self.schedule.get('val_batches'))
+            if self.is_main:
+                self._save_checkpoints()
+                print(self.metric_counter.loss_message())
+                self.metric_counter.log("Experiment Name: %s, Step: %d, Loss: %s" % (
+                    self.config['experiment_desc'], done, self.metric_counter.loss_message()))
+            self.metric_counter.clear()
+            last_validation = time.monotonic()
+        tq.close()
+
+    def _unfreeze(self):
+        trained = {id(p) for group in self.optimizer_G.param_groups for p in group['params']}
+        unwrap(self.netG).unfreeze()
+        if is_distributed():
+            # DDP only synchronises parameters that required grad when it was constructed
+            self.netG = parallelize(unwrap(self.netG), cuda=self.device.type == 'cuda')
+        # the backbone joins the running optimizer and schedule, so the Adam moments of the other
+        # parameters and the position in the learning rate schedule are kept
+        group = self.optimizer_G.param_groups[0]
+        self.optimizer_G.add_param_group({'params': [p for p in self.netG.parameters()
+                                                     if p.requires_grad and id(p) not in trained],
+                                          'lr': group['lr'],
+                                          'initial_lr': group.get('initial_lr', group['lr'])})
+        if hasattr(self.scheduler_G, 'base_lrs'):
+            self.scheduler_G.base_lrs.append(self.optimizer_G.param_groups[-1]['initial_lr'])
+        if hasattr(self.scheduler_G, 'min_lrs'):
+            self.scheduler_G.min_lrs.append(self.scheduler_G.min_lrs[0])
+
+    def _write_timings(self, step):
+        if not self.timer.enabled:
+            return
+        self.metric_counter.write_timings(self.timer.histograms(), step)
+        if self.is_main:
+            self.timer.to_json('timings_{}.json'.format(self.config['experiment_desc']))
+        self.timer.clear()
+
+    def _save_checkpoints(self):
+        if self.metric_counter.update_best_model():
             torch.save({
                 'model': self.netG.state_dict()
-            }, 'last_{}.h5'.format(self.config['experiment_desc']))
-            print(self.metric_counter.loss_message())
-            logging.debug("Experiment Name: %s, Epoch: %d, Loss: %s" % (
-                self.config['experiment_desc'], epoch, self.metric_counter.loss_message()))
+            }, 'best_{}.h5'.format(self.config['experiment_desc']))
+        torch.save({
+            'model': self.netG.state_dict()
+        }, 'last_{}.h5'.format(self.config['experiment_desc']))
 
     def _run_epoch(self, epoch):
         self.metric_counter.clear()
         for param_group in self.optimizer_G.param_groups:
             lr = param_group['lr']
 
-        epoch_size = config.get('train_batches_per_epoch') or len(self.train_dataset)
-        tq = tqdm.tqdm(self.train_dataset, total=epoch_size)
+        epoch_size = self.config.get('train_batches_per_epoch') or len(self.train_dataset)
+        tq = tqdm.tqdm(self.train_dataset, total=epoch_size, disable=not self.is_main)
         tq.set_description('Epoch {}, lr {}'.format(epoch, lr))
         i = 0
-        for data in tq:
-            inputs, targets = self.model.get_input(data)
-            outputs = self.netG(inputs)
-            loss_D = self._update_d(outputs, targets)
-            self.optimizer_G.zero_grad()
-            loss_content = self.criterionG(outputs, targets)
-            loss_adv = self.adv_trainer.loss_g(outputs, targets)
-            loss_G = loss_content + self.adv_lambda * loss_adv
-            loss_G.backward()
-            self.optimizer_G.step()
-            self.metric_counter.add_losses(loss_G.item(), loss_content.item(), loss_D)
-            curr_psnr, curr_ssim, img_for_vis = self.model.get_images_and_metrics(inputs, outputs, targets)
-            self.metric_counter.add_metrics(curr_psnr, curr_ssim)
+        for data in self.timer.iterate(tq, 'data'):
+            img_for_vis = self._train_step(data)
             tq.set_postfix(loss=self.metric_counter.loss_message())
             if not i:
                 self.metric_counter.add_image(img_for_vis, tag='train')
             i += 1
-            if i > epoch_size:
+            if i >= epoch_size:
                 break
         tq.close()
         self.metric_counter.write_to_tensorboard(epoch)
+        self._write_timings(epoch)
 
-    def _validate(self, epoch):
+    def _train_step(self, data):
+        update_g = self.steps_done % self.d_updates_per_g == 0
+        self.steps_done += 1
+        with self.timer.stage('to_device'):
+            inputs, targets = self.model.get_input(data)
+        with self.timer.stage('g_forward'), torch.set_grad_enabled(update_g):
+            outputs = self.netG(inputs)
+        with self.timer.stage('d_update'):
+            loss_D = self._update_d(outputs, targets)
+        if update_g:
+            with self.timer.stage('g_update'), self._frozen_d():
+                self.optimizer_G.zero_grad()
+                loss_content = self.criterionG(outputs, targets)
+                loss_adv = self.adv_trainer.loss_g(outputs, targets)
+                loss_G = loss_content + self.adv_lambda * loss_adv
+                loss_G.backward()
+                self.optimizer_G.step()
+        with self.timer.stage('metrics'):
+            if update_g:
+                self.metric_counter.add_losses(loss_G.item(), loss_content.item(), loss_D)
+            else:
+                self.metric_counter.add_d_loss(loss_D)
+            curr_psnr, curr_ssim, img_for_vis = self.model.get_images_and_metrics(inputs, outputs, targets)
+            self.metric_counter.add_metrics(curr_psnr, curr_ssim)
+        return img_for_vis
+
+    def _validate(self, epoch, num_batches=None):
         self.metric_counter.clear()
-        epoch_size = config.get('val_batches_per_epoch') or len(self.val_dataset)
-        tq = tqdm.tqdm(self.val_dataset, total=epoch_size)
+        epoch_size = num_batches or self.config.get('val_batches_per_epoch') or len(self.val_dataset)
+        tq = tqdm.tqdm(self.val_dataset, total=epoch_size, disable=not self.is_main)
         tq.set_description('Validation')
         i = 0
         for data in tq:
             inputs, targets = self.model.get_input(data)
-            outputs = self.netG(inputs)
-            loss_content = self.criterionG(outputs, targets)
-            loss_adv = self.adv_trainer.loss_g(outputs, targets)
+            with torch.no_grad():
+                outputs = self.netG(inputs)
+                loss_content = self.criterionG(outputs, targets)
+                loss_adv = self.adv_trainer.loss_g(outputs, targets)
             loss_G = loss_content + self.adv_lambda * loss_adv
             self.metric_counter.add_losses(loss_G.item(), loss_content.item())
             curr_psnr, curr_ssim, img_for_vis = self.model.get_images_and_metrics(inputs, outputs, targets)
@@ -102,20 +211,42 @@ class Trainer:
             if not i:
                 self.metric_counter.add_image(img_for_vis, tag='val')
             i += 1
-            if i > epoch_size:
+            if i >= epoch_size:
                 break
         tq.close()
+        # every rank validated its shard, the best model is chosen on all of them
+        self.metric_counter.synchronize()
         self.metric_counter.write_to_tensorboard(epoch, validation=True)
 
     def _update_d(self, outputs, targets):
         if self.config['model']['d_name'] == 'no_gan':
             return 0
         self.optimizer_D.zero_grad()
+        # the loss only sees outputs.detach(), nothing of its graph is needed by the generator update
         loss_D = self.adv_lambda * self.adv_trainer.loss_d(outputs, targets)
-        loss_D.backward(retain_graph=True)
+        loss_D.backward()
         self.optimizer_D.step()
         return loss_D.item()
 
+    @contextmanager
+    def _frozen_d(self):
+        """In the generator update the discriminators only pass gradients through to G. Their weight
+        gradients are not computed (nor all-reduced under DDP), the next D update zeroes them anyway."""
+        net_d = self.adv_trainer.net_d
+        nets = list(net_d.values()) if isinstance(net_d, dict) else [net_d] if net_d is not None else []
+        params = [p for net in nets for p in net.parameters() if p.requires_grad]
+        with ExitStack() as stack:
+            for net in nets:
+                if isinstance(net, DistributedDataParallel):
+                    stack.enter_context(net.no_sync())
+            for p in params:
+                p.requires_grad_(False)
+            try:
+                yield
+            finally:
+                for p in params:
+                    p.requires_grad_(True)
+
     def _get_optim(self, params):
         if self.config['optimizer']['name'] == 'adam':
             optimizer = optim.Adam(params, lr=self.config['optimizer']['lr'])
@@ -128,19 +259,29 @@ class Trainer:
         return optimizer
 
     def _get_scheduler(self, optimizer):
+        # in step mode the schedulers are stepped after every batch, so their lengths are counted in steps
+        if self.step_mode:
+            num_epochs, start_epoch = self.schedule['num_steps'], self.config['scheduler'].get('start_step', 0)
+        else:
+            num_epochs, start_epoch = self.config['num_epochs'], self.config['scheduler']['start_epoch']
         if self.config['scheduler']['name'] == 'plateau':
             scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer,
                                                              mode='min',
                                                              patience=self.config['scheduler']['patience'],
                                                              factor=self.config['scheduler']['factor'],
                                                              min_lr=self.config['scheduler']['min_lr'])
-        elif self.config['optimizer']['name'] == 'sgdr':
-            scheduler = WarmRestart(optimizer)
+        elif self.config['scheduler']['name'] == 'sgdr':
+            t_max = self.config['scheduler'].get('t_max', 30)
+            if self.step_mode:
+                # t_max counts epochs, the scheduler is stepped after every batch in step mode
+                loader = self.train_dataset
+                t_max *= self.config.get('train_batches_per_epoch') or len(loader.dataset) // loader.batch_size
+            scheduler = WarmRestart(optimizer, T_max=t_max)
         elif self.config['scheduler']['name'] == 'linear':
             scheduler = LinearDecay(optimizer,
                                     min_lr=self.config['scheduler']['min_lr'],
-                                    num_epochs=self.config['num_epochs'],
-                                    start_epoch=self.config['scheduler']['start_epoch'])
+                                    num_epochs=num_epochs,
+                                    start_epoch=start_epoch)
         else:
             raise ValueError("Scheduler [%s] not recognized." % self.config['scheduler']['name'])
         return scheduler
@@ -157,14 +298,14 @@ class Trainer:
             raise ValueError("Discriminator Network [%s] not recognized." % d_name)
 
     def _init_params(self):
-        self.criterionG, criterionD = get_loss(self.config['model'])
-        self.netG, netD = get_nets(self.config['model'])
+        self.criterionG, criterionD = get_loss(self.config['model'], self.device)
+        self.netG, netD = get_nets(self.config['model'], cuda=self.device.type == 'cuda')
         if self.continue_:
-            self.netG.load_state_dict(torch.load("./best_fpn.h5")['model'])
+            self.netG.load_state_dict(torch.load("./best_fpn.h5", map_location=self.device)['model'])
             print("mod weights loaded succefully from previous checkpoint")
-        self.netG.cuda(0)
+        self.netG.to(self.device)
         self.adv_trainer = self._get_adversarial_trainer(self.config['model']['d_name'], netD, criterionD)
-        self.model = get_model(self.config['model'])
+        self.model = get_model(self.config['model'], self.device)
         self.optimizer_G = self._get_optim(filter(lambda p: p.requires_grad, self.netG.parameters()))
         self.optimizer_D = self._get_optim(self.adv_trainer.get_params())
         self.scheduler_G = self._get_scheduler(self.optimizer_G)
@@ -175,13 +316,25 @@ if __name__ == '__main__':
     with open('config/config.yaml', 'r') as f:
         config = yaml.load(f)
     #print(config)
-    batch_size = config.pop('batch_size')
-    get_dataloader = partial(DataLoader, batch_size=batch_size, num_workers=cpu_count(), shuffle=True, drop_last=True)
+    device = init_distributed(config.get('distributed', {}).get('backend', 'nccl'))
+    loader_config = config.pop('dataloader', {})
+    seed = loader_config.get('seed')
+    if seed is not None:
+        # covers augmentations that run in the main process when num_workers is 0
+        random.seed(seed + get_rank())
+        np.random.seed(seed + get_rank())
+        torch.manual_seed(seed)
+    # batch_size is per process, so the global batch grows with the number of processes
+    make_dataloader = partial(get_dataloader, batch_size=config.pop('batch_size'), rank=get_rank(),
+                              world_size=get_world_size(), **loader_config)
+    step_mode = config.get('schedule', {}).get('mode', 'epoch') == 'step'
 
     datasets = map(config.pop, ('train', 'val'))
     g_name= config['model']['g_name']
     from_config_= partial(PairedDataset.from_config, g_name= g_name)
     datasets = map(from_config_, datasets)
-    train, val = map(get_dataloader, datasets)
-    trainer = Trainer(config, train=train, val=val, continue_= True)
+    train, val = make_dataloader(next(datasets), infinite=step_mode), make_dataloader(next(datasets))
+    trainer = Trainer(config, train=train, val=val, continue_= True, device=device)
     trainer.train()
+    trainer.metric_counter.close()
+    cleanup()
@@ -0,0 +1,64 @@
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='nccl'):
+    """Joins the process group described by the launcher environment (RANK, WORLD_SIZE, LOCAL_RANK,
+    MASTER_ADDR, MASTER_PORT as set by `python -m torch.distributed.run`) and returns the device
+    this process trains on. Without a launcher it returns the single-process device.
+
+    The `gloo` backend always trains on CPU, which allows multi-process runs on a single machine
+    without GPUs.
+    """
+    use_cuda = torch.cuda.is_available() and backend != 'gloo'
+    if use_cuda:
+        torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    if 'WORLD_SIZE' in os.environ and not is_distributed():
+        dist.init_process_group(backend=backend, init_method='env://')
+    return torch.device('cuda', torch.cuda.current_device()) if use_cuda else torch.device('cpu')
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast(value, src=0):
+    """Returns the value of rank `src` on every rank, for decisions all processes have to share."""
+    if not is_distributed():
+        return value
+    objects = [value]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def all_gather(value):
+    """The values of all ranks in rank order, a one element list without a process group."""
+    if not is_distributed():
+        return [value]
+    objects = [None] * get_world_size()
+    dist.all_gather_object(objects, value)
+    return objects
@@ -0,0 +1,180 @@
+import json
+import time
+from collections import defaultdict
+
+import torch
+import torch.nn as nn
+
+
+def _tensors(x):
+    if isinstance(x, torch.Tensor):
+        yield x
+    elif isinstance(x, (list, tuple)):
+        for item in x:
+            yield from _tensors(item)
+    elif isinstance(x, dict):
+        for item in x.values():
+            yield from _tensors(item)
+
+
+def count_macs(module, inputs, output):
+    """Multiply-accumulates of one call of a leaf module, 0 for modules without weights."""
+    out = next(_tensors(output), None)
+    if out is None:
+        return 0
+    if isinstance(module, nn.modules.conv._ConvNd):
+        kernel = 1
+        for k in module.kernel_size:
+            kernel *= k
+        if module.transposed:
+            x = inputs[0]
+            return x.numel() * kernel * module.out_channels // module.groups
+        return out.numel() * kernel * module.in_channels // module.groups
+    if isinstance(module, nn.Linear):
+        return out.numel() * module.in_features
+    if isinstance(module, (nn.modules.batchnorm._BatchNorm, nn.modules.instancenorm._InstanceNorm,
+                           nn.GroupNorm, nn.LayerNorm)):
+        # normalisation and the affine transform
+        return 2 * out.numel()
+    return 0
+
+
+class _Record:
+    def __init__(self, name, kind, leaf):
+        self.name = name
+        self.kind = kind
+        self.leaf = leaf
+        self.calls = 0
+        self.total = 0.
+        self.children = 0.
+        self.macs = 0
+        self.output_bytes = 0
+        self.allocated = 0
+
+    @property
+    def self_time(self):
+        # time spent in the module's own forward outside its submodules: functional ops like
+        # torch.cat, slicing, split or interpolate, which no FLOP count sees
+        return self.total - self.children
+
+
+class LayerProfiler:
+    """Hooks every submodule of a model and records per call
+    - wall time, including and excluding submodules (self time),
+    - multiply-accumulates of leaf convolutions, linear and normalisation layers,
+    - size of the outputs and, on CUDA, the change of allocated memory.
+
+        profiler = LayerProfiler(model)
+        with profiler:
+            for _ in range(iters):
+                model(x)
+        print(profiler.table())
+        profiler.save_trace('trace.json')
+
+    With cuda_sync every hook waits for the GPU, which serialises the model but attributes the
+    time of asynchronous kernels to the module that launched them. Calls run before `reset` or
+    while the profiler is not entered are not recorded.
+    """
+
+    def __init__(self, model: nn.Module, cuda_sync: bool = None):
+        self.model = model
+        self.cuda_sync = torch.cuda.is_available() if cuda_sync is None else cuda_sync
+        self.modules = {module: name or type(model).__name__ for name, module in model.named_modules()}
+        self.handles = []
+        self.reset()
+
+    def reset(self):
+        self.records = {}
+        self.events = []
+        self.stack = []
+        self.start = time.perf_counter()
+
+    def _sync(self):
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+
+    def _pre_hook(self, module, inputs):
+        self._sync()
+        memory = torch.cuda.memory_allocated() if self.cuda_sync else 0
+        self.stack.append((module, time.perf_counter(), memory, 0.))
+
+    def _hook(self, module, inputs, output):
+        self._sync()
+        end = time.perf_counter()
+        module_, start, memory, children = self.stack.pop()
+        assert module_ is module, 'unbalanced forward hooks'
+        elapsed = end - start
+        if self.stack:
+            parent = self.stack[-1]
+            self.stack[-1] = parent[:3] + (parent[3] + elapsed,)
+
+        name = self.modules[module]
+        record = self.records.get(name)
+        if record is None:
+            leaf = next(module.children(), None) is None
+            record = self.records[name] = _Record(name, type(module).__name__, leaf)
+        record.calls += 1
+        record.total += elapsed
+        record.children += children
+        if record.leaf:
+            record.macs += count_macs(module, inputs, output)
+        record.output_bytes += sum(t.numel() * t.element_size() for t in _tensors(output))
+        if self.cuda_sync:
+            record.allocated += torch.cuda.memory_allocated() - memory
+        self.events.append({'name': name, 'cat': record.kind, 'ph': 'X', 'pid': 0, 'tid': 0,
+                            'ts': (start - self.start) * 1e6, 'dur': elapsed * 1e6})
+
+    def __enter__(self):
+        for module in self.modules:
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook))
+            self.handles.append(module.register_forward_hook(self._hook))
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.stack = []
+        return False
+
+    def layers(self):
+        """Per module, averaged over the calls of the root module, ranked by self time."""
+        root = self.records.get(self.modules[self.model])
+        runs = root.calls if root else 1
+        rows = [{'name': r.name, 'type': r.kind, 'calls': r.calls // runs,
+                 'self_ms': r.self_time / runs * 1000, 'total_ms': r.total / runs * 1000,
+                 'gmacs': r.macs / runs / 1e9, 'output_mb': r.output_bytes / runs / 2 ** 20,
+                 'allocated_mb': r.allocated / runs / 2 ** 20 if self.cuda_sync else None}
+                for r in self.records.values()]
+        return sorted(rows, key=lambda row: row['self_ms'], reverse=True)
+
+    def types(self):
+        """Self time, MACs and outputs summed per module type, ranked by self time."""
+        summed = defaultdict(lambda: {'modules': 0, 'calls': 0, 'self_ms': 0., 'gmacs': 0., 'output_mb': 0.})
+        for row in self.layers():
+            total = summed[row['type']]
+            total['modules'] += 1
+            for key in ('calls', 'self_ms', 'gmacs', 'output_mb'):
+                total[key] += row[key]
+        rows = [dict(type=kind, **total) for kind, total in summed.items()]
+        return sorted(rows, key=lambda row: row['self_ms'], reverse=True)
+
+    def table(self, top: int = 30) -> str:
+        layers, types = self.layers(), self.types()
+        forward_ms = sum(row['self_ms'] for row in layers) or 1.
+        lines = [f'{"layer":<48} {"type":<20} {"calls":>5} {"self ms":>9} {"%":>6} {"total ms":>9} '
+                 f'{"GMACs":>8} {"out MB":>8}' + (f' {"alloc MB":>9}' if self.cuda_sync else '')]
+        for row in layers[:top]:
+            lines.append(f'{row["name"][-48:]:<48} {row["type"][:20]:<20} {row["calls"]:>5} {row["self_ms"]:>9.2f} '
+                         f'{row["self_ms"] / forward_ms:>6.1%} {row["total_ms"]:>9.2f} {row["gmacs"]:>8.3f} '
+                         f'{row["output_mb"]:>8.1f}' + (f' {row["allocated_mb"]:>9.1f}' if self.cuda_sync else ''))
+        lines += ['', f'{"type":<20} {"modules":>7} {"calls":>6} {"self ms":>9} {"%":>6} {"GMACs":>8} {"out MB":>8}']
+        for row in types:
+            lines.append(f'{row["type"][:20]:<20} {row["modules"]:>7} {row["calls"]:>6} {row["self_ms"]:>9.2f} '
+                         f'{row["self_ms"] / forward_ms:>6.1%} {row["gmacs"]:>8.3f} {row["output_mb"]:>8.1f}')
+        return '\n'.join(lines)
+
+    def save_trace(self, path: str):
+        """Chrome trace format, open it in chrome://tracing or https://ui.perfetto.dev."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
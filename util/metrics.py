@@ -1,4 +1,5 @@
 import math
+from functools import lru_cache
 from math import exp
 
 import numpy as np
@@ -19,31 +20,44 @@ def create_window(window_size, channel):
     return window
 
 
-def SSIM(img1, img2):
-    (_, channel, _, _) = img1.size()
-    window_size = 11
-    window = create_window(window_size, channel)
+@lru_cache(maxsize=None)
+def get_window(window_size, channel, device, dtype, sigma=1.5):
+    """Cached depthwise gaussian window of shape (channel, 1, window_size, window_size)."""
+    # built outside inference mode even when first requested inside it: a cached inference tensor
+    # could not be used by autograd afterwards, e.g. with SSIM as a training loss
+    with torch.inference_mode(False), torch.no_grad():
+        x = torch.arange(window_size, dtype=torch.float64) - window_size // 2
+        gauss = torch.exp(-x ** 2 / (2 * sigma ** 2))
+        gauss = gauss / gauss.sum()
+        window = torch.outer(gauss, gauss).to(device=device, dtype=dtype)
+        return window.expand(channel, 1, window_size, window_size).contiguous()
 
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
 
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+def SSIM(img1, img2, window_size=11, size_average=True):
+    """SSIM with a gaussian window for NCHW batches in [0, 1]. Returns the mean over the batch,
+    or one value per image with size_average=False."""
+    (_, channel, _, _) = img1.size()
+    # the five moment maps come from a single grouped convolution over the stacked inputs
+    moments = torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], dim=1)
+    window = get_window(window_size, 5 * channel, img1.device, img1.dtype)
+    moments = F.conv2d(moments, window, padding=window_size // 2, groups=5 * channel)
+    mu1, mu2, img1_sq, img2_sq, img12 = moments.split(channel, dim=1)
 
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
 
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img12 - mu1_mu2
 
     C1 = 0.01 ** 2
     C2 = 0.03 ** 2
 
     ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
-    return ssim_map.mean()
+    if size_average:
+        return ssim_map.mean()
+    return ssim_map.flatten(1).mean(1)
 
 
 def PSNR(img1, img2):
@@ -52,3 +66,12 @@ def PSNR(img1, img2):
         return 100
     PIXEL_MAX = 1
     return 20 * math.log10(PIXEL_MAX / math.sqrt(mse))
+
+
+def PSNR_batch(img1, img2):
+    """PSNR of every image in two NHWC uint8 batches, as a NumPy array."""
+    diff = img1.astype(np.float32) - img2.astype(np.float32)
+    mse = np.mean(diff * diff, axis=tuple(range(1, diff.ndim))) / 255. ** 2
+    with np.errstate(divide='ignore'):
+        psnr = -10 * np.log10(mse)
+    return np.where(mse == 0, 100, psnr)
@@ -0,0 +1,222 @@
+import os
+import select
+import socket
+import struct
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+SOCKET_DIR = '/tmp/ghost_deblur'
+WORKER_SOCKET = 'worker.sock'
+# num_slots, height, width
+HEADER = 3
+MESSAGE = struct.Struct('=i')
+# control messages in place of a slot index: a client (re)created its ring, or closed it; the
+# worker maps the ring of the name anew on the next frame
+ATTACH = -1
+DETACH = -2
+# segments created by this process, the resource tracker has to keep them registered
+_OWNED = set()
+
+
+def _create(name: str, size: int) -> SharedMemory:
+    try:
+        return SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # left behind by an owner that crashed before it could unlink it
+        stale = SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        return SharedMemory(name=name, create=True, size=size)
+
+
+class FrameRing:
+    """Preallocated input and output slots for BGR uint8 frames of one resolution in shared memory.
+
+    The owner creates the segment, replacing a stale one of the same name, other processes attach
+    to it by name. Slots are returned as NumPy views, so writing a frame into a slot or reading a
+    result from it copies nothing between processes.
+    """
+
+    def __init__(self, name: str, height: int = 0, width: int = 0, num_slots: int = 4, create: bool = False):
+        self.name = name
+        if create:
+            frame_size = height * width * 3
+            self.shm = _create(name, HEADER * 4 + 2 * num_slots * frame_size)
+            _OWNED.add(self.shm._name)
+            np.ndarray(HEADER, dtype=np.int32, buffer=self.shm.buf)[:] = (num_slots, height, width)
+        else:
+            self.shm = SharedMemory(name=name)
+            # the resource tracker would unlink a segment it did not create when this process exits
+            if self.shm._name not in _OWNED:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.owner = create
+        self.num_slots, self.height, self.width = map(int, np.ndarray(HEADER, dtype=np.int32, buffer=self.shm.buf))
+        frames = np.ndarray((2, self.num_slots, self.height, self.width, 3), dtype=np.uint8,
+                            buffer=self.shm.buf, offset=HEADER * 4)
+        self.inputs, self.outputs = frames
+
+    def close(self):
+        if self.shm is None:
+            return
+        # all views of the slots have to be released before the segment can be closed
+        del self.inputs, self.outputs
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _OWNED.discard(self.shm._name)
+        self.shm = None
+
+
+class SharedFrameClient:
+    """Camera side of the shared memory transport.
+
+        client = SharedFrameClient('camera0', 720, 1280)
+        slot, frame = client.acquire()
+        capture.read(frame)          # decode straight into the slot
+        client.submit(slot)
+        result = client.wait(slot)   # view of the deblurred BGR frame
+        ...                          # marker detection on `result`
+        client.release(slot)
+
+    Notifications are 4 byte datagrams with the slot index on Unix sockets, frames never leave
+    shared memory. Up to `num_slots` frames can be in flight. Creating and closing a client are
+    announced with ATTACH and DETACH, so the worker drops its mapping of a former ring of the name.
+    """
+
+    def __init__(self, name: str, height: int, width: int, num_slots: int = 4, socket_dir: str = SOCKET_DIR):
+        self.ring = FrameRing(name, height, width, num_slots, create=True)
+        self.free = list(range(num_slots))
+        self.done = set()
+        self.worker_address = os.path.join(socket_dir, WORKER_SOCKET)
+        self.address = os.path.join(socket_dir, name + '.sock')
+        os.makedirs(socket_dir, exist_ok=True)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+        # a worker may still map the segment of a former client of this name
+        self._notify(ATTACH)
+
+    def _notify(self, message: int):
+        try:
+            self.socket.sendto(MESSAGE.pack(message), self.worker_address)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # no worker yet, it attaches on the first frame
+            pass
+
+    def acquire(self):
+        """Returns a free slot index and the writable view of its input frame."""
+        if not self.free:
+            raise RuntimeError('all slots are in flight, wait for and release a result first')
+        slot = self.free.pop(0)
+        return slot, self.ring.inputs[slot]
+
+    def submit(self, slot: int):
+        self.socket.sendto(MESSAGE.pack(slot), self.worker_address)
+
+    def wait(self, slot: int, timeout: float = None) -> np.ndarray:
+        """Blocks until `slot` has been deblurred and returns the view of its output frame."""
+        self.socket.settimeout(timeout)
+        while slot not in self.done:
+            done, = MESSAGE.unpack(self.socket.recv(MESSAGE.size))
+            self.done.add(done)
+        self.done.remove(slot)
+        return self.ring.outputs[slot]
+
+    def release(self, slot: int):
+        self.free.append(slot)
+
+    def __call__(self, frame: np.ndarray, timeout: float = None) -> np.ndarray:
+        """Deblurs one frame and returns a copy of the result, for callers that don't manage slots."""
+        slot, view = self.acquire()
+        view[:] = frame
+        self.submit(slot)
+        try:
+            return self.wait(slot, timeout).copy()
+        finally:
+            self.release(slot)
+
+    def close(self):
+        if self.socket.fileno() != -1:
+            self._notify(DETACH)
+        self.socket.close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.ring.close()
+
+
+class SharedMemoryWorker:
+    """Predictor side of the shared memory transport (see SharedFrameClient), shm_server.py runs it.
+
+    Every client owns a FrameRing named like its socket. Frames announced by clients are deblurred
+    in batches per ring, written straight into the output slots and acknowledged with the slot index.
+    """
+
+    def __init__(self, predictor, socket_dir: str = SOCKET_DIR, max_batch_size: int = 8):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.rings = {}
+        os.makedirs(socket_dir, exist_ok=True)
+        self.address = os.path.join(socket_dir, WORKER_SOCKET)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+
+    def _ring(self, client_address: str) -> FrameRing:
+        if client_address not in self.rings:
+            name = os.path.splitext(os.path.basename(client_address))[0]
+            self.rings[client_address] = FrameRing(name)
+        return self.rings[client_address]
+
+    def _receive(self):
+        """Blocks for one notification, then drains the ones already queued without blocking."""
+        requests = {}
+        select.select([self.socket], [], [])
+        while True:
+            try:
+                message, client_address = self.socket.recvfrom(MESSAGE.size, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return requests
+            slot, = MESSAGE.unpack(message)
+            if slot < 0:
+                # the ring of this address was replaced or closed, frames queued for it are gone
+                self._drop(client_address)
+                requests.pop(client_address, None)
+                continue
+            requests.setdefault(client_address, []).append(slot)
+
+    def _drop(self, client_address: str):
+        ring = self.rings.pop(client_address, None)
+        if ring is not None:
+            ring.close()
+
+    def _process(self, client_address: str, slots):
+        ring = self._ring(client_address)
+        for start in range(0, len(slots), self.max_batch_size):
+            batch = slots[start:start + self.max_batch_size]
+            preds = self.predictor.predict_batch([ring.inputs[slot] for slot in batch], bgr=True)
+            for slot, pred in zip(batch, preds):
+                ring.outputs[slot][:] = pred
+                self.socket.sendto(MESSAGE.pack(slot), client_address)
+
+    def step(self):
+        """Waits for notifications and deblurs the frames they announce."""
+        for client_address, slots in self._receive().items():
+            try:
+                self._process(client_address, slots)
+            except (FileNotFoundError, ConnectionRefusedError):
+                # the client went away together with its ring
+                self._drop(client_address)
+
+    def serve(self):
+        while True:
+            self.step()
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.socket.close()
+        os.unlink(self.address)
@@ -0,0 +1,93 @@
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.timer.cuda_sync and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        self.timer.times[self.name].append(time.perf_counter() - self.start)
+        return False
+
+
+class StageTimer:
+    """Records wall times of named stages, e.g.
+
+        with timer.stage('forward'):
+            pred = model(x)
+
+    A disabled timer only costs the `stage` call. GPU work is asynchronous, with cuda_sync=True
+    every stage waits for it so its time is attributed to the right stage.
+    """
+
+    def __init__(self, enabled=True, cuda_sync=False):
+        self.enabled = enabled
+        self.cuda_sync = cuda_sync
+        self.times = defaultdict(list)
+
+    def stage(self, name):
+        return _Stage(self, name) if self.enabled else _NULL_STAGE
+
+    def iterate(self, iterable, name='data'):
+        """Wraps an iterable, e.g. a DataLoader, timing how long every item takes to arrive."""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.times[name].append(time.perf_counter() - start)
+            yield item
+
+    def clear(self):
+        self.times = defaultdict(list)
+
+    def histograms(self):
+        return {name: np.array(times) for name, times in self.times.items()}
+
+    def summary(self):
+        summary = {}
+        for name, times in self.histograms().items():
+            times_ms = times * 1000
+            summary[name] = {'count': len(times),
+                             'total_s': float(times.sum()),
+                             'mean_ms': float(times_ms.mean()),
+                             'p50_ms': float(np.percentile(times_ms, 50)),
+                             'p90_ms': float(np.percentile(times_ms, 90)),
+                             'p99_ms': float(np.percentile(times_ms, 99)),
+                             'max_ms': float(times_ms.max())}
+        return summary
+
+    def message(self):
+        return '; '.join(f'{name}={s["mean_ms"]:.2f}ms' for name, s in self.summary().items())
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)